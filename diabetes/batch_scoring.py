@@ -0,0 +1,123 @@
+"""
+Batch scoring job: writes preliminary reports for every observation
+that has observation data but was not scored yet.
+"""
+import asyncio
+import numpy as np
+from datetime import date
+from itertools import repeat
+from time import perf_counter
+from asyncpg import Record
+
+from database import DataBaseInterface, SCORING_CHUNK_SIZE, TRAIN_DATA_DTYPES
+from notation import Observation, PreliminaryReport
+from pipeline import ProductPipeline, records_to_dataframe
+
+
+# Chunks waiting between two stages, bounds the memory of the job.
+SCORING_QUEUE_SIZE = 2
+
+
+class BatchScorer(object):
+    """
+    Fetching, scoring and writing run as three stages connected by bounded
+    queues, so the next chunk is read from the cursor and the previous one
+    is copied into preliminary_report while the current one is scored.
+    """
+
+    def __init__(
+        self,
+        pipeline: ProductPipeline = None,
+        chunk_size: int = SCORING_CHUNK_SIZE,
+        queue_size: int = SCORING_QUEUE_SIZE,
+    ) -> None:
+        self.pipeline = pipeline
+        self.chunk_size = chunk_size
+        self.queue_size = queue_size
+
+        self.report_date = date.today()
+        self.scored_count = 0
+
+    def score_chunk(self, records: list[Record]) -> list[tuple]:
+        """
+        Preliminary report rows for one chunk, scored with one vectorized call.
+        """
+        data = records_to_dataframe(records, TRAIN_DATA_DTYPES)
+        values = self.pipeline.run(data).to_numpy()
+        probabilities = self.pipeline.score(values)
+
+        observation_ids = data[Observation.OBSERVATION_ID.name].to_numpy(np.int64)
+        return list(
+            zip(
+                observation_ids.tolist(),
+                probabilities.tolist(),
+                repeat(self.report_date),
+            )
+        )
+
+    async def _fetch(self, db: DataBaseInterface, scoring: asyncio.Queue) -> None:
+        async for records in db.iter_unscored_observations(self.chunk_size):
+            await scoring.put(records)
+        await scoring.put(None)
+
+    async def _score(self, scoring: asyncio.Queue, writing: asyncio.Queue) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            records = await scoring.get()
+            if records is None:
+                break
+
+            reports = await loop.run_in_executor(None, self.score_chunk, records)
+            await writing.put(reports)
+        await writing.put(None)
+
+    async def _write(self, db: DataBaseInterface, writing: asyncio.Queue) -> None:
+        while True:
+            reports = await writing.get()
+            if reports is None:
+                break
+
+            await db.copy_records(PreliminaryReport, reports)
+            self.scored_count += len(reports)
+
+    async def main(self) -> int:
+        if self.pipeline is None:
+            loop = asyncio.get_running_loop()
+            self.pipeline = await loop.run_in_executor(None, ProductPipeline)
+
+        # One connection holds the cursor, another one writes.
+        db = DataBaseInterface(2)
+        await db.create_pool()
+
+        scoring = asyncio.Queue(self.queue_size)
+        writing = asyncio.Queue(self.queue_size)
+        tasks = [
+            asyncio.create_task(self._fetch(db, scoring)),
+            asyncio.create_task(self._score(scoring, writing)),
+            asyncio.create_task(self._write(db, writing)),
+        ]
+
+        try:
+            await asyncio.gather(*tasks)
+        except Exception:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            raise
+        finally:
+            await db.destroy_pool()
+
+        return self.scored_count
+
+    def run(self) -> int:
+        start = perf_counter()
+
+        loop = asyncio.get_event_loop()
+        scored = loop.run_until_complete(self.main())
+
+        print(f"Scored {scored} observations in {perf_counter() - start:.1f} s")
+        return scored
+
+
+if __name__ == "__main__":
+    BatchScorer().run()
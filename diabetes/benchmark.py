@@ -0,0 +1,456 @@
+"""
+Benchmarks for the hot paths of the service. Run the needed one from __main__.
+"""
+import json
+import tracemalloc
+import numpy as np
+import pandas as pd
+from pathlib import Path
+from datetime import date
+from time import perf_counter
+from dateutil.relativedelta import relativedelta
+from sklearn.neighbors import KNeighborsClassifier
+
+from asyncpg import Connection
+
+from database import (
+    DataBaseFiller,
+    DataBaseInterface,
+    DataBaseInit,
+    TRAIN_DATA_QUERY,
+    TRAIN_DATA_INCREMENT_QUERY,
+    TRAIN_DATA_DTYPES,
+    config,
+)
+from notation import (
+    Patient,
+    Observation,
+    ObservationData,
+    FinalReport,
+    PreliminaryReport,
+    Feature,
+    DataSet,
+)
+from pipeline import ProductPipeline, records_to_dataframe
+from neighbors import BACKENDS
+from util import (
+    count_years,
+    PreviousDataGenerator,
+    PatientObject,
+    ObservationObject,
+    ObservationDataObject,
+    FinalReportObject,
+    PreliminaryReportObject,
+    ObservationDataBatch,
+)
+
+
+def report(name: str, seconds: float, rows: int) -> None:
+    print(f"{name:<32} {seconds:>10.4f} s {rows / seconds:>14.1f} rows/s")
+
+
+async def benchmark_filler() -> None:
+    generator = PreviousDataGenerator()
+    row_data = generator.get_data()
+    bulk_data = generator.get_data()
+
+    filler = DataBaseFiller()
+    start = perf_counter()
+    await filler.main(
+        PatientObject.from_dataframe(row_data),
+        ObservationObject.from_dataframe(row_data),
+        ObservationDataObject.from_dataframe(row_data),
+        FinalReportObject.from_dataframe(row_data),
+    )
+    report("row by row INSERT", perf_counter() - start, len(row_data))
+    await filler.DB.destroy_pool()
+
+    filler = DataBaseFiller()
+    start = perf_counter()
+    await filler.bulk_main(bulk_data)
+    report("binary COPY", perf_counter() - start, len(bulk_data))
+    await filler.DB.destroy_pool()
+
+
+async def benchmark_submit_observation(repeats: int = 1000) -> None:
+    data = PreviousDataGenerator().get_data().iloc[:1]
+
+    db = DataBaseInterface(2)
+    await db.create_pool()
+
+    patient = PatientObject.from_dataframe(data)[0]
+    patient[Patient.PATIENT_ID.name] = await db.insert_patient_data(patient)
+    observation = ObservationDataObject.from_dataframe(data)[0]
+    report = PreliminaryReportObject(
+        {
+            PreliminaryReport.PRELIMINARY_DIAGNOSIS.name: 0.5,
+            PreliminaryReport.REPORT_DATE.name: date.today(),
+        }
+    )
+
+    start = perf_counter()
+    for _ in range(repeats):
+        observation_id = await db.schedule_observation(patient)
+        observation[ObservationData.OBSERVATION_ID.name] = observation_id
+        report[PreliminaryReport.OBSERVATION_ID.name] = observation_id
+        await db.insert_observation_data(observation)
+        await db.insert_preliminary_report_data(report)
+    separate_seconds = perf_counter() - start
+    print(f"three round trips {separate_seconds / repeats * 1000:>10.3f} ms per visit")
+
+    start = perf_counter()
+    for _ in range(repeats):
+        await db.submit_observation(patient, observation, report=report)
+    cte_seconds = perf_counter() - start
+    print(f"submit_observation {cte_seconds / repeats * 1000:>9.3f} ms per visit")
+
+    await db.destroy_pool()
+
+
+BENCHMARK_SCHEMA = "benchmark"
+
+# Synthetic rows, four observations per patient, one report per observation.
+BENCHMARK_FILL_QUERIES = [
+    f"""
+    INSERT INTO {Patient.TABLE_NAME} (
+        {Patient.LAST_NAME.name}, {Patient.FIRST_NAME.name},
+        {Patient.PATRONYMIC.name}, {Patient.BIRTHDAY.name},
+        {Patient.PHONE_NUMBER.name}, {Patient.GENDER.name}
+    )
+    SELECT 'last' || i, 'first' || i, 'patronymic', date '1940-01-01' + i % 20000,
+        lpad(i::TEXT, 11, '8'), 'm'
+    FROM generate_series(1, $1 / 4) AS i;
+    """,
+    f"""
+    INSERT INTO {Observation.TABLE_NAME} (
+        {Observation.PATIENT_ID.name}, {Observation.OBSERVATION_DATE.name}
+    )
+    SELECT 1 + i % ($1 / 4), date '2010-01-01' + i % 5000
+    FROM generate_series(1, $1) AS i;
+    """,
+    f"""
+    INSERT INTO {ObservationData.TABLE_NAME}
+    SELECT i, i % 10, random() * 200, random() * 120, random() * 60,
+        random() * 800, random() * 60, random() * 2
+    FROM generate_series(1, $1) AS i;
+    """,
+    f"""
+    INSERT INTO {FinalReport.TABLE_NAME} (
+        {FinalReport.OBSERVATION_ID.name}, {FinalReport.DIAGNOSIS.name},
+        {FinalReport.REPORT_DATE.name}
+    )
+    SELECT i, random() < 0.35, date '2010-01-08' + i % 5000
+    FROM generate_series(1, $1) AS i;
+    """,
+]
+
+# The schema before the migrations: no keys and indexes on the join columns.
+BENCHMARK_OLD_SCHEMA_QUERIES = [
+    f"ALTER TABLE {ObservationData.TABLE_NAME} "
+    f"DROP CONSTRAINT {ObservationData.TABLE_NAME}_pkey;",
+    f"ALTER TABLE {FinalReport.TABLE_NAME} "
+    f"DROP CONSTRAINT {FinalReport.TABLE_NAME}_pkey;",
+    "ANALYZE;",
+]
+
+PATIENT_LOOKUP_QUERY = f"""
+    SELECT {Observation.OBSERVATION_ID.name}, {Observation.OBSERVATION_DATE.name}
+    FROM {Observation.TABLE_NAME}
+    WHERE {Observation.PATIENT_ID.name} = $1;
+    """
+
+
+async def explain(connection: Connection, name: str, query: str, *args) -> None:
+    plan = await connection.fetchval(
+        f"EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) {query.strip().rstrip(';')}",
+        *args,
+    )
+    plan = json.loads(plan)[0]
+
+    root = plan["Plan"]
+    print(
+        f"{name:<32} {plan['Execution Time']:>10.1f} ms "
+        f"{root['Node Type']}, shared hit {root.get('Shared Hit Blocks', 0)}, "
+        f"read {root.get('Shared Read Blocks', 0)}"
+    )
+
+
+async def benchmark_schema(rows: int = 1_000_000) -> None:
+    """
+    EXPLAIN ANALYZE of the training join and the lookups on a scratch
+    schema, before and after DataBaseInit.migrate.
+    """
+    init = DataBaseInit(config["DB_DIABETES"])
+    connection: Connection = await init._user_conn()
+
+    try:
+        await connection.execute(f"DROP SCHEMA IF EXISTS {BENCHMARK_SCHEMA} CASCADE;")
+        await connection.execute(f"CREATE SCHEMA {BENCHMARK_SCHEMA};")
+        await connection.execute(f"SET search_path TO {BENCHMARK_SCHEMA};")
+
+        await init.create_patient_relation(connection)
+        await init.create_observation_relation(connection)
+        await init.create_observation_data_relation(connection)
+        await init.create_final_report_relation(connection)
+        await init.create_preliminary_report_relation(connection)
+
+        start = perf_counter()
+        for query in BENCHMARK_FILL_QUERIES:
+            await connection.execute(query, rows)
+        report("generate_series fill", perf_counter() - start, rows)
+
+        for query in BENCHMARK_OLD_SCHEMA_QUERIES:
+            await connection.execute(query)
+
+        for stage in ("before migrations", "after migrations"):
+            if stage == "after migrations":
+                start = perf_counter()
+                await init.migrate(connection)
+                report("migrate", perf_counter() - start, rows)
+
+            print(f"--- {stage}, {rows} observations")
+            await explain(connection, "training join", TRAIN_DATA_QUERY)
+            await explain(
+                connection,
+                "training increment",
+                TRAIN_DATA_INCREMENT_QUERY,
+                rows - 1000,
+                date(2023, 9, 1),
+            )
+            await explain(connection, "patient lookup", PATIENT_LOOKUP_QUERY, 42)
+
+    finally:
+        await connection.execute(f"DROP SCHEMA IF EXISTS {BENCHMARK_SCHEMA} CASCADE;")
+        await connection.close()
+
+
+def benchmark_generator(rows: int = 10_000_000) -> None:
+    generator = PreviousDataGenerator(seed=42)
+
+    start = perf_counter()
+    data = generator.get_data(n_rows=rows)
+    report("PreviousDataGenerator.get_data", perf_counter() - start, len(data))
+
+
+def measure(name: str, function, rows: int):
+    tracemalloc.start()
+    start = perf_counter()
+    result = function()
+    seconds = perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    report(name, seconds, rows)
+    print(f"{'':<32} peak memory {peak / 2**20:>10.1f} MiB")
+    return result
+
+
+def benchmark_entities(rows: int = 500_000) -> None:
+    data = PreviousDataGenerator(seed=42).get_data(n_rows=rows)
+    keys = ObservationData.get_keys()
+
+    objects = measure(
+        "EntityObject.from_dataframe",
+        lambda: ObservationDataObject.from_dataframe(data),
+        rows,
+    )
+    measure(
+        "EntityObject values",
+        lambda: [[entity[key.name] for key in keys] for entity in objects],
+        rows,
+    )
+    del objects
+
+    batch = measure(
+        "EntityBatch.from_dataframe",
+        lambda: ObservationDataBatch.from_dataframe(data),
+        rows,
+    )
+    measure("EntityBatch.records", batch.records, rows)
+
+    measure("EntityBatch.to_records", batch.to_records, rows)
+
+
+async def benchmark_extraction() -> None:
+    """
+    Training data as dicts per Record, as typed arrays from Records,
+    and as typed arrays parsed from a binary COPY stream.
+    """
+    db = DataBaseInterface(1)
+    await db.create_pool()
+
+    async def from_dicts():
+        records = await db.get_data_to_train()
+        return pd.DataFrame.from_dict(list(map(dict, records)))
+
+    async def from_records():
+        records = await db.get_data_to_train()
+        return records_to_dataframe(records, TRAIN_DATA_DTYPES)
+
+    async def from_copy():
+        return pd.DataFrame(await db.copy_data_to_train(), copy=False)
+
+    try:
+        for name, extract in (
+            ("Records to dicts", from_dicts),
+            ("Records to typed arrays", from_records),
+            ("binary COPY", from_copy),
+        ):
+            tracemalloc.start()
+            start = perf_counter()
+            data = await extract()
+            seconds = perf_counter() - start
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+
+            report(name, seconds, len(data))
+            print(f"{'':<32} peak memory {peak / 2**20:>10.1f} MiB")
+            frame = data.memory_usage(deep=True).sum()
+            print(f"{'':<32} frame {frame / 2**20:>10.1f} MiB")
+            del data
+
+    finally:
+        await db.destroy_pool()
+
+
+def random_dates(rows: int, rng: np.random.Generator, start: str, days: int):
+    offsets = rng.integers(0, days, rows).astype("timedelta64[D]")
+    return pd.Series(np.datetime64(start, "D") + offsets)
+
+
+def benchmark_count_age(rows: int = 1_000_000, apply_rows: int = 100_000) -> None:
+    rng = np.random.default_rng(42)
+    data = pd.DataFrame(
+        {
+            Patient.BIRTHDAY.name: random_dates(rows, rng, "1940-01-01", 60 * 365),
+            Observation.OBSERVATION_DATE.name: random_dates(
+                rows, rng, "2010-01-01", 15 * 365
+            ),
+        }
+    )
+
+    start = perf_counter()
+    age = count_years(
+        data[Patient.BIRTHDAY.name],
+        data[Observation.OBSERVATION_DATE.name],
+    )
+    report("vectorized count_years", perf_counter() - start, rows)
+
+    sample = data.iloc[:apply_rows]
+    start = perf_counter()
+    expected = sample.apply(
+        lambda row: relativedelta(
+            row[Observation.OBSERVATION_DATE.name],
+            row[Patient.BIRTHDAY.name],
+        ).years,
+        axis=1,
+    )
+    report("apply + relativedelta", perf_counter() - start, apply_rows)
+
+    assert (age[:apply_rows] == expected.to_numpy()).all()
+
+
+def benchmark_predict_one(repeats: int = 10_000) -> None:
+    pipeline = ProductPipeline()
+    data = PreviousDataGenerator().get_data().iloc[:1]
+
+    row = data.iloc[0]
+    observation = {column: row[column] for column in Feature.numeric_columns[:-1]}
+    birthday = row[Patient.BIRTHDAY.name].date()
+    observation_date = row[Observation.OBSERVATION_DATE.name].date()
+
+    start = perf_counter()
+    for _ in range(repeats):
+        X = pipeline.run(data)
+        frame_proba = pipeline.score(X.to_numpy())[0]
+    report("DataFrame ProductPipeline.run", perf_counter() - start, repeats)
+
+    start = perf_counter()
+    for _ in range(repeats):
+        proba = pipeline.predict_one(observation, birthday, observation_date)
+    report("predict_one", perf_counter() - start, repeats)
+
+    print(f"probabilities: {frame_proba} / {proba}")
+
+
+def synthetic_neighbors_data(
+    rows: int,
+    rng: np.random.Generator,
+) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Standardized seed rows resampled with gaussian noise.
+    """
+    data = pd.read_csv(Path(__file__).parent / "diabetes.csv")
+    y = data.pop(DataSet.DIAGNOSIS.name).to_numpy() == 1
+    X = data.to_numpy(dtype=np.float64)
+    X = (X - X.mean(axis=0)) / X.std(axis=0)
+
+    sample = rng.integers(0, len(X), rows)
+    noise = rng.normal(scale=0.1, size=(rows, X.shape[1]))
+    return X[sample] + noise, y[sample]
+
+
+def benchmark_neighbors(
+    sizes: tuple[int] = (10_000, 100_000, 1_000_000),
+    queries: int = 1_000,
+    single_queries: int = 100,
+) -> None:
+    rng = np.random.default_rng(42)
+
+    for rows in sizes:
+        X, y = synthetic_neighbors_data(rows + queries, rng)
+        X_train, y_train = X[:rows], y[:rows]
+        X_test, y_test = X[rows:], y[rows:]
+
+        print(f"--- {rows} train rows, {queries} queries")
+
+        knn = KNeighborsClassifier().fit(X_train, y_train)
+        start = perf_counter()
+        expected = knn.predict_proba(X_test)[:, 1]
+        report("sklearn default batch", perf_counter() - start, queries)
+
+        start = perf_counter()
+        for value in X_test[:single_queries]:
+            knn.predict_proba(value[None, :])
+        report("sklearn default single", perf_counter() - start, single_queries)
+        print(f"{'':<32} accuracy {((expected > 0.5) == y_test).mean():.4f}")
+
+        for backend in BACKENDS.values():
+            if backend.backend == "exact" and rows * queries > 10**8:
+                print(f"{backend.backend:<32} skipped, full distance matrix")
+                continue
+
+            start = perf_counter()
+            scorer = backend.from_model(knn)
+            build = perf_counter() - start
+
+            start = perf_counter()
+            probabilities = scorer.predict_proba(X_test)
+            report(f"{backend.backend} batch", perf_counter() - start, queries)
+
+            start = perf_counter()
+            for value in X_test[:single_queries]:
+                scorer.predict_proba(value[None, :])
+            report(f"{backend.backend} single", perf_counter() - start, single_queries)
+
+            accuracy = ((probabilities > 0.5) == y_test).mean()
+            agreement = (probabilities == expected).mean()
+            print(
+                f"{'':<32} build {build:.2f} s, accuracy {accuracy:.4f}, "
+                f"same as sklearn {agreement:.4f}"
+            )
+
+
+if __name__ == "__main__":
+    ## bulk COPY against row by row INSERT, needs the database
+    # import asyncio
+    # asyncio.run(benchmark_filler())
+    # asyncio.run(benchmark_submit_observation())
+    # asyncio.run(benchmark_schema())
+    # asyncio.run(benchmark_extraction())
+
+    benchmark_count_age()
+    # benchmark_generator()
+    # benchmark_entities()
+    # benchmark_predict_one()
+    # benchmark_neighbors()
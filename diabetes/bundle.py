@@ -0,0 +1,273 @@
+"""
+Versioned model bundle: a directory with a manifest and raw .npy arrays.
+Large arrays are opened with mmap_mode, so worker processes share one
+physical copy of the training matrix through the page cache.
+"""
+import json
+import shutil
+import numpy as np
+from pathlib import Path
+from datetime import date, datetime
+from sklearn.neighbors import KNeighborsClassifier
+
+from preprocessing import Preprocessor
+from neighbors import (
+    NeighborsScorer,
+    BACKENDS,
+    TRAIN_X,
+    TRAIN_POSITIVE,
+    TRAIN_NORMS,
+    scorer_from_model,
+)
+
+
+# Format 1 bundles have no backend fields and hold an exact float64 index.
+# Format 3 adds the training watermark, needed for incremental updates.
+BUNDLE_FORMAT = 3
+SUPPORTED_FORMATS = (1, 2, 3)
+
+MANIFEST = "manifest.json"
+LATEST = "LATEST"
+
+FILL_VALUES = "fill_values.npy"
+FILL_MASK = "fill_mask.npy"
+MEAN = "mean.npy"
+SCALE = "scale.npy"
+OBSERVATION_IDS = "observation_ids.npy"
+
+# Delta segments appended after training, one .npz per update.
+DELTAS = "deltas"
+DELTA_X = "x"
+DELTA_POSITIVE = "positive"
+DELTA_OBSERVATION_IDS = "observation_ids"
+DELTA_WATERMARK_ID = "watermark_id"
+DELTA_WATERMARK_DATE = "watermark_date"
+
+
+def new_version() -> str:
+    return datetime.now().strftime("%Y%m%d%H%M%S%f")
+
+
+def latest_bundle(root: Path) -> Path:
+    pointer = root / LATEST
+    if not pointer.exists():
+        return None
+    return root / pointer.read_text().strip()
+
+
+class ModelBundle(object):
+    """
+    observation_ids holds every observation seen at training time, and
+    watermark the last observation_id / final_report_date of that data.
+    Rows after the watermark may be appended as delta segments.
+    """
+
+    def __init__(
+        self,
+        preprocessor: Preprocessor,
+        scorer: NeighborsScorer,
+        version: str = None,
+        observation_ids: np.ndarray = None,
+        watermark: tuple[int, date] = None,
+    ) -> None:
+        self.preprocessor = preprocessor
+        self.scorer = scorer
+        self.version = version or new_version()
+
+        self.observation_ids = observation_ids
+        self.watermark = watermark
+
+        self.generation = 0
+        self.delta_ids = np.empty(0, dtype=np.int64)
+
+    @classmethod
+    def from_fitted(
+        self,
+        preprocessor: Preprocessor,
+        model: KNeighborsClassifier,
+        backend: str = NeighborsScorer.backend,
+        observation_ids: np.ndarray = None,
+        watermark: tuple[int, date] = None,
+        **backend_params,
+    ) -> "ModelBundle":
+        scorer = scorer_from_model(model, backend, **backend_params)
+        return self(preprocessor, scorer, None, observation_ids, watermark)
+
+    @property
+    def incremental(self) -> bool:
+        return self.observation_ids is not None and self.watermark is not None
+
+    def manifest(self) -> dict:
+        return {
+            "format": BUNDLE_FORMAT,
+            "version": self.version,
+            "columns": self.preprocessor.columns,
+            "n_neighbors": self.scorer.n_neighbors,
+            "train_rows": len(self.scorer.X),
+            "backend": self.scorer.backend,
+            "backend_params": self.scorer.params(),
+            "arrays": list(self.scorer.arrays()),
+            "watermark": (
+                None
+                if self.watermark is None
+                else [self.watermark[0], self.watermark[1].isoformat()]
+            ),
+        }
+
+    def save(self, root: Path, make_latest: bool = True) -> Path:
+        """
+        Writes into a temporary directory and renames it, then moves
+        the LATEST pointer, so readers never see a half-written bundle.
+        """
+        path = root / self.version
+        temporary = root / f".{self.version}.tmp"
+        if temporary.exists():
+            shutil.rmtree(temporary)
+        temporary.mkdir(parents=True)
+
+        np.save(temporary / FILL_VALUES, self.preprocessor.fill_values)
+        np.save(temporary / FILL_MASK, self.preprocessor.fill_mask)
+        np.save(temporary / MEAN, self.preprocessor.mean)
+        np.save(temporary / SCALE, self.preprocessor.scale)
+        for name, array in self.scorer.arrays().items():
+            np.save(temporary / f"{name}.npy", np.ascontiguousarray(array))
+        if self.observation_ids is not None:
+            np.save(temporary / OBSERVATION_IDS, self.observation_ids)
+
+        with open(temporary / MANIFEST, "w") as file:
+            json.dump(self.manifest(), file, indent=4)
+
+        temporary.rename(path)
+
+        if make_latest:
+            pointer = root / f".{LATEST}.tmp"
+            pointer.write_text(self.version)
+            pointer.replace(root / LATEST)
+
+        return path
+
+    @classmethod
+    def load(self, path: Path, mmap_mode: str = "r") -> "ModelBundle":
+        with open(path / MANIFEST) as file:
+            manifest = json.load(file)
+
+        if manifest["format"] not in SUPPORTED_FORMATS:
+            raise ValueError(f"Unsupported model bundle format {manifest['format']}")
+
+        preprocessor = Preprocessor(
+            columns=manifest["columns"],
+            fill_values=np.load(path / FILL_VALUES),
+            fill_mask=np.load(path / FILL_MASK),
+            mean=np.load(path / MEAN),
+            scale=np.load(path / SCALE),
+        )
+
+        backend = BACKENDS[manifest.get("backend", NeighborsScorer.backend)]
+        names = manifest.get("arrays", [TRAIN_X, TRAIN_POSITIVE, TRAIN_NORMS])
+        arrays = {
+            name: np.load(path / f"{name}.npy", mmap_mode=mmap_mode)
+            for name in names
+        }
+        scorer = backend.from_arrays(
+            arrays,
+            manifest["n_neighbors"],
+            **manifest.get("backend_params", {}),
+        )
+
+        observation_ids = None
+        if (path / OBSERVATION_IDS).exists():
+            observation_ids = np.load(path / OBSERVATION_IDS, mmap_mode=mmap_mode)
+
+        watermark = manifest.get("watermark")
+        if watermark is not None:
+            watermark = (watermark[0], date.fromisoformat(watermark[1]))
+
+        bundle = self(
+            preprocessor,
+            scorer,
+            manifest["version"],
+            observation_ids,
+            watermark,
+        )
+        bundle.load_deltas(path)
+
+        print(f"Uploaded model bundle {manifest['version']}")
+        return bundle
+
+    def is_known(self, observation_ids: np.ndarray) -> np.ndarray:
+        """
+        Mask of observations already in the index, trained on or appended.
+        """
+        known = np.isin(observation_ids, self.observation_ids)
+        known |= np.isin(observation_ids, self.delta_ids)
+        return known
+
+    def _apply_delta(
+        self,
+        values: np.ndarray,
+        positive: np.ndarray,
+        observation_ids: np.ndarray,
+        watermark: tuple[int, date],
+    ) -> None:
+        self.scorer.append(values, positive)
+        self.delta_ids = np.concatenate([self.delta_ids, observation_ids])
+        self.watermark = watermark
+        self.generation += 1
+
+    def load_deltas(self, path: Path) -> int:
+        """
+        Applies the delta segments of the bundle at path written after
+        the current generation. Returns the number of applied segments.
+        """
+        segments = sorted((path / DELTAS).glob("[0-9]*.npz"))
+
+        applied = 0
+        for segment in segments[self.generation :]:
+            with np.load(segment) as delta:
+                watermark = (
+                    delta[DELTA_WATERMARK_ID].item(),
+                    delta[DELTA_WATERMARK_DATE].item(),
+                )
+                self._apply_delta(
+                    delta[DELTA_X],
+                    delta[DELTA_POSITIVE],
+                    delta[DELTA_OBSERVATION_IDS],
+                    watermark,
+                )
+            applied += 1
+
+        return applied
+
+    def append(
+        self,
+        path: Path,
+        values: np.ndarray,
+        positive: np.ndarray,
+        observation_ids: np.ndarray,
+        watermark: tuple[int, date],
+    ) -> Path:
+        """
+        Writes preprocessed labeled rows as the next delta segment of
+        the bundle at path, then adds them to the in-memory index.
+        The segment is renamed into place, so readers never see half of it.
+        """
+        deltas = path / DELTAS
+        deltas.mkdir(exist_ok=True)
+
+        segment = deltas / f"{self.generation + 1:06d}.npz"
+        temporary = deltas / f".{segment.name}.tmp"
+        with open(temporary, "wb") as file:
+            np.savez(
+                file,
+                **{
+                    DELTA_X: values,
+                    DELTA_POSITIVE: positive,
+                    DELTA_OBSERVATION_IDS: observation_ids,
+                    DELTA_WATERMARK_ID: np.int64(watermark[0]),
+                    DELTA_WATERMARK_DATE: np.datetime64(watermark[1], "D"),
+                },
+            )
+        temporary.rename(segment)
+
+        self._apply_delta(values, positive, observation_ids, watermark)
+        return segment
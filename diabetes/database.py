@@ -2,12 +2,16 @@ import sys
 import asyncpg
 import asyncio
 import pandas as pd
+import numpy as np
+from io import BytesIO
 from pathlib import Path
 from asyncpg import Pool, Connection, Record
 from asyncio import Lock
-from typing import Any
-from functools import wraps
-from datetime import datetime, timedelta
+from typing import Any, AsyncIterator, Awaitable, Callable
+from functools import wraps, partial
+from time import perf_counter
+from datetime import date, datetime, timedelta
+from aiohttp.log import web_logger
 from aiohttp.web_app import Application
 
 
@@ -15,25 +19,419 @@ sys.path.append(str(Path(__file__).parent.parent))
 from common import DataBaseInitTemplate, config
 from util import (
     PreviousDataGenerator,
+    EntityObject,
     PatientObject,
     ObservationObject,
     ObservationData,
     ObservationDataObject,
     FinalReportObject,
     PreliminaryReportObject,
+    EntityRecord,
+    EntityBatch,
+    PatientBatch,
+    ObservationBatch,
+    ObservationDataBatch,
+    FinalReportBatch,
+    DATE_DTYPE,
+    parse_binary_copy,
+)
+from notation import (
+    SCHEMAS,
+    Attribute,
+    Notation,
+    Patient,
+    Observation,
+    FinalReport,
+    PreliminaryReport,
+    TrainFeatures,
+    Feature,
+    numpy_dtype,
 )
-from notation import Patient, Observation, FinalReport, PreliminaryReport
 
 
 DB_KEY = "database"
 
 
+PATIENT_SCHEMA = SCHEMAS[Patient]
+OBSERVATION_SCHEMA = SCHEMAS[Observation]
+OBSERVATION_DATA_SCHEMA = SCHEMAS[ObservationData]
+FINAL_REPORT_SCHEMA = SCHEMAS[FinalReport]
+PRELIMINARY_REPORT_SCHEMA = SCHEMAS[PreliminaryReport]
+TRAIN_FEATURES_SCHEMA = SCHEMAS[TrainFeatures]
+
+PATIENT_INSERT_KEYS = PATIENT_SCHEMA.insert_keys
+OBSERVATION_INSERT_KEYS = OBSERVATION_SCHEMA.insert_keys
+OBSERVATION_DATA_INSERT_KEYS = OBSERVATION_DATA_SCHEMA.insert_keys
+FINAL_REPORT_INSERT_KEYS = FINAL_REPORT_SCHEMA.insert_keys
+PRELIMINARY_REPORT_INSERT_KEYS = PRELIMINARY_REPORT_SCHEMA.insert_keys
+
+PATIENT_INSERT_QUERY = PATIENT_SCHEMA.insert
+OBSERVATION_INSERT_QUERY = OBSERVATION_SCHEMA.insert
+OBSERVATION_DATA_INSERT_QUERY = OBSERVATION_DATA_SCHEMA.insert
+FINAL_REPORT_INSERT_QUERY = FINAL_REPORT_SCHEMA.insert
+PRELIMINARY_REPORT_INSERT_QUERY = PRELIMINARY_REPORT_SCHEMA.insert
+
+PATIENT_BATCH_INSERT_QUERY = PATIENT_SCHEMA.batch_insert
+OBSERVATION_BATCH_INSERT_QUERY = OBSERVATION_SCHEMA.batch_insert
+
+
+FILL_CHUNK_SIZE = 50_000
+FILL_QUEUE_SIZE = 2
+
+REPORT_FLUSH_INTERVAL_MS = 50
+REPORT_FLUSH_ROWS = 500
+REPORT_QUEUE_SIZE = 10000
+# A failed flush is retried with the delay doubled after every attempt.
+REPORT_WRITE_RETRIES = 4
+REPORT_RETRY_DELAY_MS = 100
+
+# Errors of the rows themselves, which a retry of the same batch cannot fix.
+ROW_ERRORS = (
+    asyncpg.IntegrityConstraintViolationError,
+    asyncpg.DataError,
+)
+
+
+def build_submit_observation_query() -> str:
+    """
+    Inserts an observation, its data and, when the diagnosis parameter
+    is not NULL, its preliminary report with one data-modifying CTE,
+    so a visit is stored in one round trip and one transaction.
+    """
+    features = OBSERVATION_DATA_INSERT_KEYS[1:]
+    first_feature = len(OBSERVATION_INSERT_KEYS) + 1
+    diagnosis = first_feature + len(features)
+    diagnosis_param = f"${diagnosis}::{PreliminaryReport.PRELIMINARY_DIAGNOSIS.type}"
+
+    feature_columns = ", ".join(key.name for key in features)
+    feature_params = ", ".join(
+        f"${index}::{key.type}" for index, key in enumerate(features, first_feature)
+    )
+
+    return f"""
+            WITH new_observation AS (
+                INSERT INTO {Observation.TABLE_NAME} (
+                    {Observation.PATIENT_ID.name}, {Observation.OBSERVATION_DATE.name}
+                )
+                VALUES ($1, $2)
+                RETURNING {Observation.OBSERVATION_ID.name}
+            ), new_data AS (
+                INSERT INTO {ObservationData.TABLE_NAME} (
+                    {ObservationData.OBSERVATION_ID.name}, {feature_columns}
+                )
+                SELECT {Observation.OBSERVATION_ID.name}, {feature_params}
+                FROM new_observation
+            ), new_report AS (
+                INSERT INTO {PreliminaryReport.TABLE_NAME} (
+                    {PreliminaryReport.OBSERVATION_ID.name},
+                    {PreliminaryReport.PRELIMINARY_DIAGNOSIS.name},
+                    {PreliminaryReport.REPORT_DATE.name}
+                )
+                SELECT
+                    {Observation.OBSERVATION_ID.name},
+                    {diagnosis_param},
+                    ${diagnosis + 1}::{PreliminaryReport.REPORT_DATE.type}
+                FROM new_observation
+                WHERE {diagnosis_param} IS NOT NULL
+            )
+            SELECT {Observation.OBSERVATION_ID.name} FROM new_observation;
+            """
+
+
+SUBMIT_OBSERVATION_QUERY = build_submit_observation_query()
+
+
 async def get_observation_date():
     """STUB METHOD"""
     date = datetime.today().date() + timedelta(days=1)
     return date
 
 
+TRAIN_DATA_CHUNK_SIZE = 10000
+# Columns of the training join, with the table each one is read from.
+TRAIN_DATA_COLUMNS = [
+    (Patient, Patient.PATIENT_ID),
+    (Patient, Patient.BIRTHDAY),
+    (Observation, Observation.OBSERVATION_ID),
+    (Observation, Observation.OBSERVATION_DATE),
+    (ObservationData, ObservationData.PREGNANCIES),
+    (ObservationData, ObservationData.GLUCOSE),
+    (ObservationData, ObservationData.BLOOD_PRESSURE),
+    (ObservationData, ObservationData.SKIN_THICKNESS),
+    (ObservationData, ObservationData.INSULIN),
+    (ObservationData, ObservationData.BMI),
+    (ObservationData, ObservationData.DIABETES_PEDIGREE_FUNCTION),
+    (FinalReport, FinalReport.DIAGNOSIS),
+    (FinalReport, FinalReport.REPORT_DATE),
+]
+
+
+def build_train_data_query(condition: str = "") -> str:
+    columns = ",\n        ".join(
+        f"{notation.TABLE_NAME}.{key.name}" for notation, key in TRAIN_DATA_COLUMNS
+    )
+    return f"""
+        SELECT 
+        {columns}
+        FROM {Patient.TABLE_NAME} 
+            LEFT JOIN {Observation.TABLE_NAME} 
+                ON {Patient.TABLE_NAME}.{Patient.PATIENT_ID.name} 
+                = {Observation.TABLE_NAME}.{Observation.PATIENT_ID.name}
+            LEFT JOIN {ObservationData.TABLE_NAME} 
+                ON {Observation.TABLE_NAME}.{Observation.OBSERVATION_ID.name} 
+                = {ObservationData.TABLE_NAME}.{ObservationData.OBSERVATION_ID.name}
+            LEFT JOIN {FinalReport.TABLE_NAME}
+                ON {Observation.TABLE_NAME}.{Observation.OBSERVATION_ID.name} 
+                = {FinalReport.TABLE_NAME}.{FinalReport.OBSERVATION_ID.name}
+        WHERE {FinalReport.TABLE_NAME}.{FinalReport.DIAGNOSIS.name} IS NOT NULL
+        {condition};
+        """
+
+
+TRAIN_DATA_QUERY = build_train_data_query()
+
+
+def build_train_features_view_query() -> str:
+    """
+    The training join with age computed in SQL like relativedelta().years:
+    a date plus an interval of years moves February 29 to February 28, as
+    relativedelta does. One row per observation, with its latest final
+    report, so the view has a unique key and can be refreshed concurrently.
+    """
+    birthday = f"{Patient.TABLE_NAME}.{Patient.BIRTHDAY.name}"
+    observation_date = f"{Observation.TABLE_NAME}.{Observation.OBSERVATION_DATE.name}"
+    anniversary = f"{birthday} + make_interval(years => span.years)"
+
+    return f"""
+        CREATE MATERIALIZED VIEW IF NOT EXISTS {TrainFeatures.TABLE_NAME} AS
+        SELECT DISTINCT ON ({Observation.TABLE_NAME}.{Observation.OBSERVATION_ID.name})
+        {Patient.TABLE_NAME}.{Patient.PATIENT_ID.name},
+        {Observation.TABLE_NAME}.{Observation.OBSERVATION_ID.name},
+        {observation_date},
+        {ObservationData.TABLE_NAME}.{ObservationData.PREGNANCIES.name},
+        {ObservationData.TABLE_NAME}.{ObservationData.GLUCOSE.name},
+        {ObservationData.TABLE_NAME}.{ObservationData.BLOOD_PRESSURE.name},
+        {ObservationData.TABLE_NAME}.{ObservationData.SKIN_THICKNESS.name},
+        {ObservationData.TABLE_NAME}.{ObservationData.INSULIN.name},
+        {ObservationData.TABLE_NAME}.{ObservationData.BMI.name},
+        {ObservationData.TABLE_NAME}.{ObservationData.DIABETES_PEDIGREE_FUNCTION.name},
+        CASE WHEN {observation_date} >= {birthday}
+            THEN span.years - ({anniversary} > {observation_date})::INT
+            ELSE span.years + ({anniversary} < {observation_date})::INT
+        END AS {TrainFeatures.AGE.name},
+        {FinalReport.TABLE_NAME}.{FinalReport.DIAGNOSIS.name},
+        {FinalReport.TABLE_NAME}.{FinalReport.REPORT_DATE.name}
+        FROM {Patient.TABLE_NAME}
+            JOIN {Observation.TABLE_NAME}
+                ON {Patient.TABLE_NAME}.{Patient.PATIENT_ID.name}
+                = {Observation.TABLE_NAME}.{Observation.PATIENT_ID.name}
+            LEFT JOIN {ObservationData.TABLE_NAME}
+                ON {Observation.TABLE_NAME}.{Observation.OBSERVATION_ID.name}
+                = {ObservationData.TABLE_NAME}.{ObservationData.OBSERVATION_ID.name}
+            JOIN {FinalReport.TABLE_NAME}
+                ON {Observation.TABLE_NAME}.{Observation.OBSERVATION_ID.name}
+                = {FinalReport.TABLE_NAME}.{FinalReport.OBSERVATION_ID.name}
+            CROSS JOIN LATERAL (
+                SELECT (
+                    date_part('year', {observation_date})
+                    - date_part('year', {birthday})
+                )::INT AS years
+            ) AS span
+        WHERE {FinalReport.TABLE_NAME}.{FinalReport.DIAGNOSIS.name} IS NOT NULL
+        ORDER BY
+            {Observation.TABLE_NAME}.{Observation.OBSERVATION_ID.name},
+            {FinalReport.TABLE_NAME}.{FinalReport.REPORT_DATE.name} DESC NULLS LAST;
+        """
+
+
+TRAIN_FEATURES_VIEW_QUERY = build_train_features_view_query()
+TRAIN_FEATURES_INDEX_QUERY = f"""
+        CREATE UNIQUE INDEX IF NOT EXISTS
+            {TrainFeatures.TABLE_NAME}_{TrainFeatures.OBSERVATION_ID.name}
+        ON {TrainFeatures.TABLE_NAME} ({TrainFeatures.OBSERVATION_ID.name});
+        """
+
+TRAIN_FEATURES_COLUMNS = ", ".join(TRAIN_FEATURES_SCHEMA.columns)
+TRAIN_FEATURES_QUERY = TRAIN_FEATURES_SCHEMA.select
+TRAIN_FEATURES_INCREMENT_QUERY = f"""
+        SELECT {TRAIN_FEATURES_COLUMNS} FROM {TrainFeatures.TABLE_NAME}
+        WHERE {TrainFeatures.OBSERVATION_ID.name} > $1
+            OR {TrainFeatures.REPORT_DATE.name} >= $2;
+        """
+
+SCORING_CHUNK_SIZE = 10000
+
+# Observations with measured data but without a preliminary report yet.
+UNSCORED_OBSERVATIONS_QUERY = f"""
+        SELECT
+        {Patient.TABLE_NAME}.{Patient.BIRTHDAY.name},
+        {Observation.TABLE_NAME}.{Observation.OBSERVATION_ID.name},
+        {Observation.TABLE_NAME}.{Observation.OBSERVATION_DATE.name},
+        {ObservationData.TABLE_NAME}.{ObservationData.PREGNANCIES.name},
+        {ObservationData.TABLE_NAME}.{ObservationData.GLUCOSE.name},
+        {ObservationData.TABLE_NAME}.{ObservationData.BLOOD_PRESSURE.name},
+        {ObservationData.TABLE_NAME}.{ObservationData.SKIN_THICKNESS.name},
+        {ObservationData.TABLE_NAME}.{ObservationData.INSULIN.name},
+        {ObservationData.TABLE_NAME}.{ObservationData.BMI.name},
+        {ObservationData.TABLE_NAME}.{ObservationData.DIABETES_PEDIGREE_FUNCTION.name}
+        FROM {Observation.TABLE_NAME}
+            JOIN {ObservationData.TABLE_NAME}
+                ON {Observation.TABLE_NAME}.{Observation.OBSERVATION_ID.name}
+                = {ObservationData.TABLE_NAME}.{ObservationData.OBSERVATION_ID.name}
+            JOIN {Patient.TABLE_NAME}
+                ON {Observation.TABLE_NAME}.{Observation.PATIENT_ID.name}
+                = {Patient.TABLE_NAME}.{Patient.PATIENT_ID.name}
+        WHERE NOT EXISTS (
+            SELECT 1 FROM {PreliminaryReport.TABLE_NAME}
+            WHERE {PreliminaryReport.TABLE_NAME}.{PreliminaryReport.OBSERVATION_ID.name}
+                = {Observation.TABLE_NAME}.{Observation.OBSERVATION_ID.name}
+        );
+        """
+
+# Rows of observations added after the watermark, and of reports written
+# on or after its date, since a report may arrive for an older observation.
+TRAIN_DATA_INCREMENT_QUERY = build_train_data_query(
+    f"""AND (
+            {Observation.TABLE_NAME}.{Observation.OBSERVATION_ID.name} > $1
+            OR {FinalReport.TABLE_NAME}.{FinalReport.REPORT_DATE.name} >= $2
+        )"""
+)
+
+
+def train_dtypes(keys: list[Attribute]) -> dict[str, np.dtype]:
+    """
+    Registry dtypes of training columns, with the features as float64,
+    so a missing measurement reads as NaN like in the pandas frame.
+    """
+    dtypes = {key.name: numpy_dtype(key) for key in keys}
+    for name in Feature.numeric_columns:
+        if name in dtypes:
+            dtypes[name] = np.dtype(np.float64)
+    return dtypes
+
+
+TRAIN_DATA_DTYPES = train_dtypes([key for _, key in TRAIN_DATA_COLUMNS])
+TRAIN_FEATURES_DTYPES = train_dtypes(TRAIN_FEATURES_SCHEMA.keys)
+
+# SQL types of binary COPY columns and the values standing for NULL,
+# so every row of the stream has the same width.
+COPY_SQL_TYPES = {
+    np.dtype(np.int64): ("bigint", None),
+    np.dtype(np.float64): ("float8", "'NaN'"),
+    np.dtype(np.float32): ("float4", "'NaN'"),
+    np.dtype(np.bool_): ("bool", None),
+    DATE_DTYPE: ("date", "'infinity'"),
+}
+
+
+def build_copy_query(query: str, dtypes: dict[str, np.dtype]) -> str:
+    """
+    Wraps a query for parse_binary_copy: its columns cast
+    to the fixed width types of dtypes, NULLs replaced.
+    """
+    columns = []
+    for name, dtype in dtypes.items():
+        sql_type, null = COPY_SQL_TYPES[np.dtype(dtype)]
+        column = f"{name}::{sql_type}"
+        if null is not None:
+            column = f"coalesce({column}, {null}::{sql_type})"
+        columns.append(f"{column} AS {name}")
+
+    return f"""
+        SELECT {", ".join(columns)}
+        FROM ({query.strip().rstrip(";")}) AS train_rows
+        """
+
+
+# Binary COPY forms of the training queries, by the query they wrap.
+TRAIN_COPY_QUERIES = {
+    query: build_copy_query(query, dtypes)
+    for query, dtypes in [
+        (TRAIN_DATA_QUERY, TRAIN_DATA_DTYPES),
+        (TRAIN_DATA_INCREMENT_QUERY, TRAIN_DATA_DTYPES),
+        (TRAIN_FEATURES_QUERY, TRAIN_FEATURES_DTYPES),
+        (TRAIN_FEATURES_INCREMENT_QUERY, TRAIN_FEATURES_DTYPES),
+    ]
+}
+
+
+def build_primary_key_migration(
+    notation: Notation,
+    key: Attribute,
+    include: list[Attribute] = (),
+) -> str:
+    """
+    Adds the primary key to a table of an older database, when its rows
+    allow it. Otherwise falls back to a plain index on the same column.
+    """
+    table = notation.TABLE_NAME
+    included = ""
+    if include:
+        included = f"INCLUDE ({', '.join(column.name for column in include)})"
+
+    return f"""
+            DO $$
+            BEGIN
+                IF EXISTS (
+                    SELECT 1 FROM pg_constraint
+                    WHERE conrelid = '{table}'::regclass AND contype = 'p'
+                ) THEN
+                    RETURN;
+                END IF;
+
+                IF NOT EXISTS (SELECT 1 FROM {table} WHERE {key.name} IS NULL)
+                    AND NOT EXISTS (
+                        SELECT {key.name} FROM {table}
+                        GROUP BY {key.name} HAVING count(*) > 1
+                    )
+                THEN
+                    ALTER TABLE {table} ADD PRIMARY KEY ({key.name}) {included};
+                ELSE
+                    RAISE NOTICE '{table} has duplicated {key.name}, index it instead';
+                    CREATE INDEX IF NOT EXISTS {table}_{key.name}_idx
+                        ON {table} ({key.name}) {included};
+                END IF;
+            END $$;
+            """
+
+
+def build_index_query(
+    notation: Notation,
+    keys: list[Attribute],
+    include: list[Attribute] = (),
+) -> str:
+    table = notation.TABLE_NAME
+    name = "_".join([table] + [key.name for key in keys] + ["idx"])
+    columns = ", ".join(key.name for key in keys)
+
+    query = f"CREATE INDEX IF NOT EXISTS {name} ON {table} ({columns})"
+    if include:
+        query += f" INCLUDE ({', '.join(column.name for column in include)})"
+    return query + ";"
+
+
+# Idempotent, applied in order by DataBaseInit.migrate on every init_tables,
+# so an existing database gets the keys and indexes of a new one.
+SCHEMA_MIGRATIONS = [
+    build_primary_key_migration(ObservationData, ObservationData.OBSERVATION_ID),
+    build_primary_key_migration(
+        FinalReport,
+        FinalReport.OBSERVATION_ID,
+        [FinalReport.DIAGNOSIS, FinalReport.REPORT_DATE],
+    ),
+    # Per-patient lookups, and the patient side of the training join.
+    build_index_query(
+        Observation,
+        [Observation.PATIENT_ID, Observation.OBSERVATION_DATE],
+        [Observation.OBSERVATION_ID],
+    ),
+    # Foreign key of preliminary_report, and the anti-join of batch scoring.
+    build_index_query(PreliminaryReport, [PreliminaryReport.OBSERVATION_ID]),
+    # The final_report_date side of the incremental training watermark.
+    build_index_query(FinalReport, [FinalReport.REPORT_DATE]),
+]
+
+
 class DataBaseInit(DataBaseInitTemplate):
     def __init__(self, *args) -> None:
         super().__init__(*args)
@@ -42,84 +440,48 @@ class DataBaseInit(DataBaseInitTemplate):
         self,
         connection: Connection,
     ) -> None:
-        query = f"""
-                CREATE TABLE {Patient.TABLE_NAME} (
-                {Patient.LAST_NAME.name} {Patient.LAST_NAME.type} NOT NULL,
-                {Patient.FIRST_NAME.name} {Patient.FIRST_NAME.type} NOT NULL,
-                {Patient.PATRONYMIC.name} {Patient.PATRONYMIC.type},
-                {Patient.BIRTHDAY.name} {Patient.BIRTHDAY.type} NOT NULL,
-                {Patient.PHONE_NUMBER.name} {Patient.PHONE_NUMBER.type} NOT NULL,
-                {Patient.GENDER.name} {Patient.GENDER.type} NOT NULL,
-                {Patient.PATIENT_ID.name} {Patient.PATIENT_ID.type},
-                PRIMARY KEY ({Patient.PATIENT_ID.name}),
-                UNIQUE ({Patient.FIRST_NAME.name}, {Patient.LAST_NAME.name}, 
-                        {Patient.PATRONYMIC.name}, 
-                        {Patient.BIRTHDAY.name}, {Patient.PHONE_NUMBER.name})
-                );
-                """
-        await self.create_new_table(connection, query)
+        await self.create_new_table(connection, PATIENT_SCHEMA.create)
 
     async def create_observation_relation(
         self,
         connection: Connection,
     ) -> None:
-        query = f"""
-                CREATE TABLE {Observation.TABLE_NAME} (
-                {Observation.PATIENT_ID.name} {Observation.PATIENT_ID.type} REFERENCES 
-                    {Patient.TABLE_NAME} ({Patient.PATIENT_ID.name}),
-                {Observation.OBSERVATION_DATE.name} {Observation.OBSERVATION_DATE.type},
-                {Observation.OBSERVATION_ID.name} {Observation.OBSERVATION_ID.type},
-                PRIMARY KEY ({Observation.OBSERVATION_ID.name})
-                );
-                """
-        await self.create_new_table(connection, query)
+        await self.create_new_table(connection, OBSERVATION_SCHEMA.create)
 
     async def create_observation_data_relation(
         self,
         connection: Connection,
     ) -> None:
-        query = f"""
-                CREATE TABLE {ObservationData.TABLE_NAME} (
-                {ObservationData.OBSERVATION_ID.name} {ObservationData.OBSERVATION_ID.type} REFERENCES 
-                    {Observation.TABLE_NAME} ({Observation.OBSERVATION_ID.name}),
-                {ObservationData.PREGNANCIES.name} {ObservationData.PREGNANCIES.type},
-                {ObservationData.GLUCOSE.name} {ObservationData.GLUCOSE.type},
-                {ObservationData.BLOOD_PRESSURE.name} {ObservationData.BLOOD_PRESSURE.type},
-                {ObservationData.SKIN_THICKNESS.name} {ObservationData.SKIN_THICKNESS.type},
-                {ObservationData.INSULIN.name} {ObservationData.INSULIN.type},
-                {ObservationData.BMI.name} {ObservationData.BMI.type},
-                {ObservationData.DIABETES_PEDIGREE_FUNCTION.name} {ObservationData.DIABETES_PEDIGREE_FUNCTION.type}
-                );
-                """
-        await self.create_new_table(connection, query)
+        await self.create_new_table(connection, OBSERVATION_DATA_SCHEMA.create)
 
     async def create_final_report_relation(
         self,
         connection: Connection,
     ) -> None:
-        query = f"""
-                CREATE TABLE {FinalReport.TABLE_NAME} (
-                {FinalReport.OBSERVATION_ID.name} {FinalReport.OBSERVATION_ID.type} 
-                    REFERENCES {Observation.TABLE_NAME} ({Observation.OBSERVATION_ID.name}),
-                {FinalReport.DIAGNOSIS.name} {FinalReport.DIAGNOSIS.type},
-                {FinalReport.REPORT_DATE.name} {FinalReport.REPORT_DATE.type}
-                );
-                """
-        await self.create_new_table(connection, query)
+        await self.create_new_table(connection, FINAL_REPORT_SCHEMA.create)
 
     async def create_preliminary_report_relation(
         self,
         connection: Connection,
     ) -> None:
-        query = f"""
-                CREATE TABLE {PreliminaryReport.TABLE_NAME} (
-                {PreliminaryReport.OBSERVATION_ID.name} {PreliminaryReport.OBSERVATION_ID.type} 
-                    REFERENCES {Observation.TABLE_NAME} ({Observation.OBSERVATION_ID.name}),
-                {PreliminaryReport.PRELIMINARY_DIAGNOSIS.name} {PreliminaryReport.PRELIMINARY_DIAGNOSIS.type},
-                {PreliminaryReport.REPORT_DATE.name} {PreliminaryReport.REPORT_DATE.type}
-                );
-                """
-        await self.create_new_table(connection, query)
+        await self.create_new_table(connection, PRELIMINARY_REPORT_SCHEMA.create)
+
+    async def create_train_features_view(
+        self,
+        connection: Connection,
+    ) -> None:
+        await self.create_new_table(connection, TRAIN_FEATURES_VIEW_QUERY)
+        await self.create_new_table(connection, TRAIN_FEATURES_INDEX_QUERY)
+
+    async def migrate(
+        self,
+        connection: Connection,
+    ) -> None:
+        for query in SCHEMA_MIGRATIONS:
+            await self.create_new_table(connection, query)
+
+        async with self.lock:
+            await connection.execute("ANALYZE;")
 
     async def init_tables(self) -> None:
         try:
@@ -131,18 +493,168 @@ class DataBaseInit(DataBaseInitTemplate):
             await self.create_observation_data_relation(connection)
             await self.create_final_report_relation(connection)
             await self.create_preliminary_report_relation(connection)
+            await self.migrate(connection)
+            await self.create_train_features_view(connection)
 
         finally:
             if not connection.is_closed():
                 await connection.close()
 
 
+class WriteBehindBuffer(object):
+    """
+    Acknowledges rows at once and writes them in batches, every
+    flush_interval_ms or flush_rows rows, whichever comes first.
+    put waits while the queue is full, so a slow database slows
+    the producers down instead of growing the memory.
+
+    A failed batch is retried with backoff, then written row by row,
+    so only the rows the database rejects are dropped.
+    """
+
+    def __init__(
+        self,
+        write: Callable[[list[tuple]], Awaitable[None]],
+        flush_interval_ms: float = REPORT_FLUSH_INTERVAL_MS,
+        flush_rows: int = REPORT_FLUSH_ROWS,
+        queue_size: int = REPORT_QUEUE_SIZE,
+        retries: int = REPORT_WRITE_RETRIES,
+        retry_delay_ms: float = REPORT_RETRY_DELAY_MS,
+    ) -> None:
+        self.write = write
+        self.flush_interval = flush_interval_ms / 1000
+        self.flush_rows = flush_rows
+        self.retries = retries
+        self.retry_delay = retry_delay_ms / 1000
+
+        self.flushes_count = 0
+        self.written_rows = 0
+        self.failed_rows = 0
+        self.retries_count = 0
+        self.last_flush_ms: float = None
+        self.last_error: str = None
+
+        self._queue: asyncio.Queue = asyncio.Queue(queue_size)
+        self._task: asyncio.Task = None
+
+    def start(self) -> None:
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        """
+        Flushes everything already acknowledged, then stops the writer.
+        """
+        await self._queue.join()
+
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+
+    async def put(self, row: tuple) -> None:
+        await self._queue.put(row)
+
+    async def _collect(self) -> list[tuple]:
+        rows = [await self._queue.get()]
+
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.flush_interval
+
+        while len(rows) < self.flush_rows:
+            if not self._queue.empty():
+                rows.append(self._queue.get_nowait())
+                continue
+
+            timeout = deadline - loop.time()
+            if timeout <= 0:
+                break
+
+            try:
+                rows.append(await asyncio.wait_for(self._queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+
+        return rows
+
+    async def _write_batch(self, rows: list[tuple]) -> bool:
+        delay = self.retry_delay
+        for attempt in range(self.retries + 1):
+            try:
+                await self.write(rows)
+                return True
+            except ROW_ERRORS as error:
+                self.last_error = str(error)
+                return False
+            except Exception as error:
+                self.last_error = str(error)
+                if attempt == self.retries:
+                    return False
+
+                self.retries_count += 1
+                web_logger.warning(
+                    "Failed to write %d buffered rows, retry in %d ms: %s",
+                    len(rows),
+                    delay * 1000,
+                    error,
+                )
+                await asyncio.sleep(delay)
+                delay *= 2
+
+    async def _write_rows(self, rows: list[tuple]) -> int:
+        """
+        Writes rows one at a time, returns the number of written rows.
+        """
+        written = 0
+        for row in rows:
+            try:
+                await self.write([row])
+            except Exception as error:
+                self.failed_rows += 1
+                self.last_error = str(error)
+                web_logger.error("Dropped buffered row %r: %s", row, error)
+            else:
+                written += 1
+        return written
+
+    async def _flush(self, rows: list[tuple]) -> None:
+        start = perf_counter()
+        try:
+            if await self._write_batch(rows):
+                self.written_rows += len(rows)
+                self.last_error = None
+            else:
+                self.written_rows += await self._write_rows(rows)
+        finally:
+            self.flushes_count += 1
+            self.last_flush_ms = (perf_counter() - start) * 1000
+            for _ in rows:
+                self._queue.task_done()
+
+    async def _run(self) -> None:
+        while True:
+            await self._flush(await self._collect())
+
+    def metrics(self) -> dict:
+        return {
+            "queued_rows": self._queue.qsize(),
+            "queue_size": self._queue.maxsize,
+            "flushes": self.flushes_count,
+            "written_rows": self.written_rows,
+            "failed_rows": self.failed_rows,
+            "retries": self.retries_count,
+            "last_flush_ms": self.last_flush_ms,
+            "last_error": self.last_error,
+        }
+
+
 class DataBaseInterface(object):
     def __init__(
         self,
         db_connections_count: int,
     ) -> None:
         self.db_connections_count = db_connections_count
+        self.reports_buffer: WriteBehindBuffer = None
 
     async def create_pool(self) -> None:
         print("CREATE DB CONNECTIONS POOL")
@@ -157,37 +669,39 @@ class DataBaseInterface(object):
         )
 
     async def destroy_pool(self) -> None:
+        if self.reports_buffer is not None:
+            await self.reports_buffer.stop()
+            self.reports_buffer = None
+
         await self._pool.close()
 
+    def start_reports_buffer(
+        self,
+        flush_interval_ms: float = REPORT_FLUSH_INTERVAL_MS,
+        flush_rows: int = REPORT_FLUSH_ROWS,
+        queue_size: int = REPORT_QUEUE_SIZE,
+    ) -> None:
+        """
+        Preliminary reports from buffer_preliminary_report_data
+        are written with binary COPY in the background.
+        """
+        self.reports_buffer = WriteBehindBuffer(
+            partial(self.copy_records, PreliminaryReport),
+            flush_interval_ms,
+            flush_rows,
+            queue_size,
+        )
+        self.reports_buffer.start()
+
     async def insert_patient_data(
         self,
         patient: PatientObject,
     ) -> int:
-        query = f"""
-                    INSERT INTO {Patient.TABLE_NAME} (
-                        {Patient.LAST_NAME.name}, 
-                        {Patient.FIRST_NAME.name}, 
-                        {Patient.PATRONYMIC.name}, 
-                        {Patient.BIRTHDAY.name},
-                        {Patient.PHONE_NUMBER.name}, 
-                        {Patient.GENDER.name}
-                    )
-                    VALUES (
-                        '{patient[Patient.LAST_NAME.name]}', 
-                        '{patient[Patient.FIRST_NAME.name]}',
-                        '{patient[Patient.PATRONYMIC.name]}', 
-                        '{patient[Patient.BIRTHDAY.name]}',
-                        '{patient[Patient.PHONE_NUMBER.name]}', 
-                        '{patient[Patient.GENDER.name]}'
-                    )
-                    RETURNING {Patient.PATIENT_ID.name};
-                """
+        values = [patient[key.name] for key in PATIENT_INSERT_KEYS]
 
         async with self._pool.acquire() as connection:
             connection: Connection
-
-            patient_id = await connection.fetch(query)
-            patient_id = patient_id[0][Patient.PATIENT_ID.name]
+            patient_id = await connection.fetchval(PATIENT_INSERT_QUERY, *values)
 
         return patient_id
 
@@ -199,22 +713,46 @@ class DataBaseInterface(object):
         if not settled_date:
             settled_date = await get_observation_date()
 
-        query = f"""
-                    INSERT INTO {Observation.TABLE_NAME} (
-                        {Observation.PATIENT_ID.name}, 
-                        {Observation.OBSERVATION_DATE.name}
-                    ) 
-                    VALUES (
-                        '{patient[Patient.PATIENT_ID.name]}',
-                        '{settled_date}'
-                    )
-                    RETURNING {Observation.OBSERVATION_ID.name};
-                """
+        async with self._pool.acquire() as connection:
+            connection: Connection
+            observation_id = await connection.fetchval(
+                OBSERVATION_INSERT_QUERY,
+                patient[Patient.PATIENT_ID.name],
+                settled_date,
+            )
+
+        return observation_id
+
+    async def submit_observation(
+        self,
+        patient: PatientObject,
+        observation: ObservationDataObject,
+        settled_date: datetime = None,
+        report: PreliminaryReportObject = None,
+    ) -> int:
+        """
+        schedule_observation, insert_observation_data and optionally
+        insert_preliminary_report_data in one statement. observation_id
+        of the data and the report is ignored, the new one is returned.
+        """
+        if not settled_date:
+            settled_date = await get_observation_date()
+
+        values = [patient[Patient.PATIENT_ID.name], settled_date]
+        values += [observation[key.name] for key in OBSERVATION_DATA_INSERT_KEYS[1:]]
+        if report is None:
+            values += [None, None]
+        else:
+            values += [
+                report[PreliminaryReport.PRELIMINARY_DIAGNOSIS.name],
+                report[PreliminaryReport.REPORT_DATE.name],
+            ]
 
         async with self._pool.acquire() as connection:
             connection: Connection
-            observation_id = await connection.fetch(query)
-            observation_id = observation_id[0][Observation.OBSERVATION_ID.name]
+            observation_id = await connection.fetchval(
+                SUBMIT_OBSERVATION_QUERY, *values
+            )
 
         return observation_id
 
@@ -222,109 +760,300 @@ class DataBaseInterface(object):
         self,
         observation: ObservationDataObject,
     ) -> None:
-        query = f"""
-                INSERT INTO {ObservationData.TABLE_NAME} (
-                    {ObservationData.OBSERVATION_ID.name},
-                    {ObservationData.PREGNANCIES.name},
-                    {ObservationData.GLUCOSE.name},
-                    {ObservationData.BLOOD_PRESSURE.name},
-                    {ObservationData.SKIN_THICKNESS.name},
-                    {ObservationData.INSULIN.name},
-                    {ObservationData.BMI.name},
-                    {ObservationData.DIABETES_PEDIGREE_FUNCTION.name}
-                )
-                VALUES (
-                    {observation[ObservationData.OBSERVATION_ID.name]},
-                    {observation[ObservationData.PREGNANCIES.name]},
-                    {observation[ObservationData.GLUCOSE.name]},
-                    {observation[ObservationData.BLOOD_PRESSURE.name]},
-                    {observation[ObservationData.SKIN_THICKNESS.name]},
-                    {observation[ObservationData.INSULIN.name]},
-                    {observation[ObservationData.BMI.name]},
-                    {observation[ObservationData.DIABETES_PEDIGREE_FUNCTION.name]}
-                );
-                """
+        values = [observation[key.name] for key in OBSERVATION_DATA_INSERT_KEYS]
 
         async with self._pool.acquire() as connection:
             connection: Connection
-            await connection.execute(query)
+            await connection.execute(OBSERVATION_DATA_INSERT_QUERY, *values)
 
     async def insert_final_report_data(
         self,
         report: FinalReportObject,
     ) -> None:
-        query = f"""
-                INSERT INTO {FinalReport.TABLE_NAME} (
-                    {FinalReport.OBSERVATION_ID.name},
-                    {FinalReport.DIAGNOSIS.name},
-                    {FinalReport.REPORT_DATE.name}
-                )
-                VALUES (
-                    '{report[FinalReport.OBSERVATION_ID.name]}',
-                    '{report[FinalReport.DIAGNOSIS.name]}',
-                    '{report[FinalReport.REPORT_DATE.name]}'
-                );
-                """
+        values = [report[key.name] for key in FINAL_REPORT_INSERT_KEYS]
 
         async with self._pool.acquire() as connection:
             connection: Connection
-            await connection.execute(query)
+            await connection.execute(FINAL_REPORT_INSERT_QUERY, *values)
 
     async def insert_preliminary_report_data(
         self,
         report: PreliminaryReportObject,
     ) -> None:
-        query = f"""
-                INSERT INTO {PreliminaryReport.TABLE_NAME} (
-                    {PreliminaryReport.OBSERVATION_ID.name},
-                    {PreliminaryReport.PRELIMINARY_DIAGNOSIS.name},
-                    {PreliminaryReport.REPORT_DATE.name}
-                )
-                VALUES (
-                    '{report[PreliminaryReport.OBSERVATION_ID.name]}',
-                    '{report[PreliminaryReport.PRELIMINARY_DIAGNOSIS.name]}',
-                    '{report[PreliminaryReport.REPORT_DATE.name]}'
-                );
-                """
+        values = [report[key.name] for key in PRELIMINARY_REPORT_INSERT_KEYS]
 
         async with self._pool.acquire() as connection:
             connection: Connection
-            await connection.execute(query)
-
-    async def get_data_to_train(self):
-        query = f"""
-                SELECT 
-                {Patient.TABLE_NAME}.{Patient.PATIENT_ID.name},
-                {Patient.TABLE_NAME}.{Patient.BIRTHDAY.name},
-                {Observation.TABLE_NAME}.{Observation.OBSERVATION_ID.name},
-                {Observation.TABLE_NAME}.{Observation.OBSERVATION_DATE.name},
-                {ObservationData.TABLE_NAME}.{ObservationData.PREGNANCIES.name},
-                {ObservationData.TABLE_NAME}.{ObservationData.GLUCOSE.name},
-                {ObservationData.TABLE_NAME}.{ObservationData.BLOOD_PRESSURE.name},
-                {ObservationData.TABLE_NAME}.{ObservationData.SKIN_THICKNESS.name},
-                {ObservationData.TABLE_NAME}.{ObservationData.INSULIN.name},
-                {ObservationData.TABLE_NAME}.{ObservationData.BMI.name},
-                {ObservationData.TABLE_NAME}.{ObservationData.DIABETES_PEDIGREE_FUNCTION.name},
-                {FinalReport.TABLE_NAME}.{FinalReport.DIAGNOSIS.name}
-                FROM {Patient.TABLE_NAME} 
-                    LEFT JOIN {Observation.TABLE_NAME} 
-                        ON {Patient.TABLE_NAME}.{Patient.PATIENT_ID.name} 
-                        = {Observation.TABLE_NAME}.{Observation.PATIENT_ID.name}
-                    LEFT JOIN {ObservationData.TABLE_NAME} 
-                        ON {Observation.TABLE_NAME}.{Observation.OBSERVATION_ID.name} 
-                        = {ObservationData.TABLE_NAME}.{ObservationData.OBSERVATION_ID.name}
-                    LEFT JOIN {FinalReport.TABLE_NAME}
-                        ON {Observation.TABLE_NAME}.{Observation.OBSERVATION_ID.name} 
-                        = {FinalReport.TABLE_NAME}.{FinalReport.OBSERVATION_ID.name}
-                WHERE {FinalReport.TABLE_NAME}.{FinalReport.DIAGNOSIS.name} IS NOT NULL;
-                """
+            await connection.execute(PRELIMINARY_REPORT_INSERT_QUERY, *values)
+
+    async def buffer_preliminary_report_data(
+        self,
+        report: PreliminaryReportObject,
+    ) -> None:
+        """
+        Returns once the report is queued, falls back to
+        insert_preliminary_report_data without a running buffer.
+        """
+        if self.reports_buffer is None:
+            return await self.insert_preliminary_report_data(report)
+
+        values = tuple(report[name] for name in PRELIMINARY_REPORT_SCHEMA.copy_columns)
+        await self.reports_buffer.put(values)
+
+    async def insert_patients_data(
+        self,
+        patients: list[PatientObject] | PatientBatch,
+    ) -> list[int]:
+        if not patients:
+            return []
+
+        ids = await self.reserve_ids(Patient, len(patients))
+        if isinstance(patients, EntityBatch):
+            columns = patients.column_values(PATIENT_INSERT_KEYS)
+        else:
+            columns = [
+                [patient[key.name] for patient in patients]
+                for key in PATIENT_INSERT_KEYS
+            ]
+
+        # Attribute is an unhashable dataclass, columns are keyed by name.
+        values = {key.name: column for key, column in zip(PATIENT_INSERT_KEYS, columns)}
+        values[Patient.PATIENT_ID.name] = ids
 
         async with self._pool.acquire() as connection:
             connection: Connection
-            data = await connection.fetch(query)
+            await connection.execute(
+                PATIENT_BATCH_INSERT_QUERY,
+                *[values[key] for key in PATIENT_SCHEMA.columns],
+            )
+
+        return ids
+
+    async def schedule_observations(
+        self,
+        patients: list[PatientObject] | PatientBatch,
+        settled_dates: list[datetime] = None,
+    ) -> list[int]:
+        if not patients:
+            return []
+
+        if not settled_dates:
+            settled_date = await get_observation_date()
+            settled_dates = [settled_date] * len(patients)
+
+        if isinstance(patients, EntityBatch):
+            patients_ids = patients[Patient.PATIENT_ID.name].tolist()
+        else:
+            patients_ids = [patient[Patient.PATIENT_ID.name] for patient in patients]
+
+        ids = await self.reserve_ids(Observation, len(patients))
+        values = {
+            Observation.PATIENT_ID.name: patients_ids,
+            Observation.OBSERVATION_DATE.name: settled_dates,
+            Observation.OBSERVATION_ID.name: ids,
+        }
+
+        async with self._pool.acquire() as connection:
+            connection: Connection
+            await connection.execute(
+                OBSERVATION_BATCH_INSERT_QUERY,
+                *[values[key] for key in OBSERVATION_SCHEMA.columns],
+            )
+
+        return ids
+
+    async def _insert_many(
+        self,
+        query: str,
+        keys: list[Attribute],
+        entities: list[EntityObject | EntityRecord] | EntityBatch,
+    ) -> None:
+        if not entities:
+            return
+
+        if isinstance(entities, EntityBatch):
+            values = entities.records(keys)
+        else:
+            values = [[entity[key.name] for key in keys] for entity in entities]
+
+        async with self._pool.acquire() as connection:
+            connection: Connection
+            await connection.executemany(query, values)
+
+    async def insert_observations_data(
+        self,
+        observations: list[ObservationDataObject] | ObservationDataBatch,
+    ) -> None:
+        await self._insert_many(
+            OBSERVATION_DATA_INSERT_QUERY,
+            OBSERVATION_DATA_INSERT_KEYS,
+            observations,
+        )
+
+    async def insert_final_reports_data(
+        self,
+        reports: list[FinalReportObject] | FinalReportBatch,
+    ) -> None:
+        await self._insert_many(
+            FINAL_REPORT_INSERT_QUERY,
+            FINAL_REPORT_INSERT_KEYS,
+            reports,
+        )
+
+    async def insert_preliminary_reports_data(
+        self,
+        reports: list[PreliminaryReportObject] | EntityBatch,
+    ) -> None:
+        await self._insert_many(
+            PRELIMINARY_REPORT_INSERT_QUERY,
+            PRELIMINARY_REPORT_INSERT_KEYS,
+            reports,
+        )
+
+    async def get_data_to_train(
+        self,
+        since_observation_id: int = None,
+        since_report_date: date = None,
+        from_features: bool = False,
+    ) -> list[Record]:
+        """
+        from_features reads the train_features view, with age, instead of the join.
+        """
+        query, args = self._train_query(
+            since_observation_id, since_report_date, from_features
+        )
+
+        async with self._pool.acquire() as connection:
+            connection: Connection
+            data = await connection.fetch(query, *args)
 
         return data
 
+    def _train_query(
+        self,
+        since_observation_id: int = None,
+        since_report_date: date = None,
+        from_features: bool = False,
+    ) -> tuple[str, list]:
+        if since_observation_id is None and since_report_date is None:
+            query = TRAIN_FEATURES_QUERY if from_features else TRAIN_DATA_QUERY
+            return query, []
+
+        if from_features:
+            query = TRAIN_FEATURES_INCREMENT_QUERY
+        else:
+            query = TRAIN_DATA_INCREMENT_QUERY
+        return query, [since_observation_id, since_report_date]
+
+    async def copy_data_to_train(
+        self,
+        since_observation_id: int = None,
+        since_report_date: date = None,
+        from_features: bool = False,
+    ) -> dict[str, np.ndarray]:
+        """
+        get_data_to_train as typed columns, read from a binary COPY stream
+        instead of decoding a Record per row.
+        """
+        query, args = self._train_query(
+            since_observation_id, since_report_date, from_features
+        )
+        dtypes = TRAIN_FEATURES_DTYPES if from_features else TRAIN_DATA_DTYPES
+
+        output = BytesIO()
+        async with self._pool.acquire() as connection:
+            connection: Connection
+            await connection.copy_from_query(
+                TRAIN_COPY_QUERIES[query],
+                *args,
+                output=output,
+                format="binary",
+            )
+
+        return parse_binary_copy(output.getbuffer(), dtypes)
+
+    async def _iter_query(
+        self,
+        query: str,
+        chunk_size: int,
+    ) -> AsyncIterator[list[Record]]:
+        """
+        Streams a query through a server-side cursor,
+        so only one chunk of records is held on the client at a time.
+        """
+        async with self._pool.acquire() as connection:
+            connection: Connection
+
+            async with connection.transaction():
+                cursor = await connection.cursor(query)
+                while True:
+                    records = await cursor.fetch(chunk_size)
+                    if not records:
+                        break
+                    yield records
+
+    async def iter_data_to_train(
+        self,
+        chunk_size: int = TRAIN_DATA_CHUNK_SIZE,
+        from_features: bool = False,
+    ) -> AsyncIterator[list[Record]]:
+        query = TRAIN_FEATURES_QUERY if from_features else TRAIN_DATA_QUERY
+        async for records in self._iter_query(query, chunk_size):
+            yield records
+
+    async def refresh_train_features(self, concurrently: bool = True) -> None:
+        """
+        A concurrent refresh keeps the view readable while it is rebuilt.
+        """
+        mode = "CONCURRENTLY " if concurrently else ""
+        async with self._pool.acquire() as connection:
+            connection: Connection
+            await connection.execute(
+                f"REFRESH MATERIALIZED VIEW {mode}{TrainFeatures.TABLE_NAME};"
+            )
+
+    async def iter_unscored_observations(
+        self,
+        chunk_size: int = SCORING_CHUNK_SIZE,
+    ) -> AsyncIterator[list[Record]]:
+        async for records in self._iter_query(UNSCORED_OBSERVATIONS_QUERY, chunk_size):
+            yield records
+
+    async def reserve_ids(
+        self,
+        notation: Notation,
+        count: int,
+    ) -> list[int]:
+        schema = SCHEMAS[notation]
+
+        async with self._pool.acquire() as connection:
+            connection: Connection
+            ids = await connection.fetch(schema.reserve_ids, count)
+
+        return [record[schema.serial.name] for record in ids]
+
+    async def copy_records(
+        self,
+        notation: Notation,
+        records: list[tuple],
+        columns: list[str] = None,
+    ) -> None:
+        """
+        records follow the copy_columns of the schema, or columns if given.
+        """
+        schema = SCHEMAS[notation]
+
+        async with self._pool.acquire() as connection:
+            connection: Connection
+            await connection.copy_records_to_table(
+                schema.table,
+                records=records,
+                columns=columns or schema.copy_columns,
+            )
+
+    async def copy_batch(self, batch: EntityBatch) -> None:
+        await self.copy_records(batch.notation, batch.records(), batch.columns())
+
 
 class DataBaseFiller(object):
     async def insert_patients(
@@ -404,10 +1133,141 @@ class DataBaseFiller(object):
         await self.insert_observations_data(observations_data)
         await self.insert_reports(reports)
 
-    def fill(self):
+    def _chunk_batches(self, data: pd.DataFrame) -> list[EntityBatch]:
+        return [
+            batch_type.from_dataframe(data)
+            for batch_type in (
+                PatientBatch,
+                ObservationBatch,
+                ObservationDataBatch,
+                FinalReportBatch,
+            )
+        ]
+
+    def _batches_records(
+        self,
+        batches: list[EntityBatch],
+    ) -> list[tuple[Notation, list[tuple], list[str]]]:
+        return [(batch.notation, batch.records(), batch.columns()) for batch in batches]
+
+    async def load_chunk(self, data: pd.DataFrame) -> None:
+        """
+        Writes the whole chain with binary COPY. SERIAL ids are reserved
+        from the sequences beforehand, so every table is loaded in one call.
+        Batches and records are built off the event loop, next to the other
+        chunks' COPY.
+        """
+        loop = asyncio.get_running_loop()
+        batches = await loop.run_in_executor(None, self._chunk_batches, data)
+        patients, observations, observations_data, reports = batches
+
+        patients_ids = await self.DB.reserve_ids(Patient, len(data))
+        observations_ids = await self.DB.reserve_ids(Observation, len(data))
+
+        patients[Patient.PATIENT_ID.name] = patients_ids
+        observations[Observation.PATIENT_ID.name] = patients_ids
+        observations[Observation.OBSERVATION_ID.name] = observations_ids
+        observations_data[ObservationData.OBSERVATION_ID.name] = observations_ids
+        reports[FinalReport.OBSERVATION_ID.name] = observations_ids
+
+        tables = await loop.run_in_executor(None, self._batches_records, batches)
+        patient_table, observation_table, *other_tables = tables
+
+        await self.DB.copy_records(*patient_table)
+        await self.DB.copy_records(*observation_table)
+        await asyncio.gather(*[self.DB.copy_records(*table) for table in other_tables])
+
+    async def bulk_main(self, data: pd.DataFrame) -> None:
+        self.DB = DataBaseInterface(6)
+        await self.DB.create_pool()
+
+        await self.load_chunk(data)
+
+    async def _produce(
+        self,
+        generator: PreviousDataGenerator,
+        n_rows: int,
+        chunk_size: int,
+        chunks: asyncio.Queue,
+        workers: int,
+    ) -> None:
+        loop = asyncio.get_running_loop()
+        for start in range(0, n_rows, chunk_size):
+            size = min(chunk_size, n_rows - start)
+            data = await loop.run_in_executor(None, generator.get_data, size)
+            await chunks.put(data)
+
+        for _ in range(workers):
+            await chunks.put(None)
+
+    async def _consume(self, chunks: asyncio.Queue) -> None:
+        while True:
+            data = await chunks.get()
+            if data is None:
+                break
+
+            await self.load_chunk(data)
+            self.loaded_rows += len(data)
+
+    async def stream_main(
+        self,
+        n_rows: int,
+        chunk_size: int = FILL_CHUNK_SIZE,
+        seed: int = None,
+        connections_count: int = 6,
+    ) -> int:
+        """
+        Generates and loads n_rows in chunks. One producer generates chunks
+        into a bounded queue and one writer per pool connection loads them,
+        so at most FILL_QUEUE_SIZE + connections_count chunks are in memory
+        while every connection of the pool is kept busy.
+        """
+        self.DB = DataBaseInterface(connections_count)
+        await self.DB.create_pool()
+        self.loaded_rows = 0
+
+        generator = PreviousDataGenerator(seed)
+        chunks = asyncio.Queue(FILL_QUEUE_SIZE)
+        tasks = [
+            asyncio.create_task(
+                self._produce(generator, n_rows, chunk_size, chunks, connections_count)
+            )
+        ]
+        tasks += [
+            asyncio.create_task(self._consume(chunks))
+            for _ in range(connections_count)
+        ]
+
+        try:
+            await asyncio.gather(*tasks)
+        except Exception:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            raise
+        finally:
+            await self.DB.destroy_pool()
+
+        return self.loaded_rows
+
+    def fill_stream(
+        self,
+        n_rows: int,
+        chunk_size: int = FILL_CHUNK_SIZE,
+        seed: int = None,
+    ) -> int:
+        loop = asyncio.get_event_loop()
+        return loop.run_until_complete(self.stream_main(n_rows, chunk_size, seed))
+
+    def fill(self, bulk: bool = False):
         DataGen = PreviousDataGenerator()
         data = DataGen.get_data()
 
+        if bulk:
+            loop = asyncio.get_event_loop()
+            loop.run_until_complete(self.bulk_main(data))
+            return
+
         patients = PatientObject.from_dataframe(data)
         observations = ObservationObject.from_dataframe(data)
         observations_data = ObservationDataObject.from_dataframe(data)
@@ -427,10 +1287,14 @@ class DataBaseFiller(object):
 async def create_db_interface(
     app: Application,
     connections_count: int = 6,
+    buffer_reports: bool = False,
 ) -> None:
     db = DataBaseInterface(connections_count)
     await db.create_pool()
 
+    if buffer_reports:
+        db.start_reports_buffer()
+
     app[DB_KEY] = db
 
 
@@ -1,5 +1,7 @@
+import json
 from functools import partial
 from typing import Callable
+from datetime import date
 from aiohttp import web
 from aiohttp.web_request import Request
 from aiohttp.web_response import Response
@@ -10,8 +12,26 @@ from database import (
     destroy_db_interface,
     DB_KEY,
 )
-from pipeline import create_pipeline, PIPELINE_KEY
-from notation import PageTemplate, Patient
+from pipeline import create_pipeline, PIPELINE_KEY, BUNDLES_PATH
+from serving import (
+    MicroBatcher,
+    create_batcher,
+    destroy_batcher,
+    create_executor,
+    destroy_executor,
+    create_reloader,
+    destroy_reloader,
+    create_learner,
+    destroy_learner,
+    parse_observation,
+    ModelReloader,
+    IncrementalLearner,
+    BATCHER_KEY,
+    RELOADER_KEY,
+    LEARNER_KEY,
+)
+from notation import PageTemplate, Patient, Observation, PreliminaryReport
+from util import PreliminaryReportObject
 
 
 routes = web.RouteTableDef()
@@ -23,12 +43,20 @@ def read_template(path: str) -> str:
     return content
 
 
-async def check_patient_id(app, request: Request):
+# The cookie form itself and the JSON API, called without the patient_id cookie.
+COOKIE_FREE_PATHS = frozenset(["/patient_id", "/predict", "/metrics", "/admin/reload"])
+
+
+@web.middleware
+async def check_patient_id(request: Request, handler: Callable) -> Response:
+    if request.path in COOKIE_FREE_PATHS:
+        return await handler(request)
+
     # Проверяем наличие куки с именем 'patient_id'
     patient_id = request.cookies.get(Patient.PATIENT_ID.name)
     if not patient_id:
-        return web.HTTPFound("/patient_id")
-    return await request.handler(app, request)
+        raise web.HTTPFound("/patient_id")
+    return await handler(request)
 
 
 @routes.get("/patient_id")
@@ -47,13 +75,103 @@ async def menu(request: Request) -> Response:
     return web.Response(text="Это страница Меню")
 
 
+@routes.post("/predict")
+async def predict(request: Request) -> Response:
+    try:
+        body = await request.json()
+        observation, birthday, observation_date = parse_observation(body)
+
+        observation_id = body.get(Observation.OBSERVATION_ID.name)
+        if observation_id is not None:
+            observation_id = int(observation_id)
+    except (KeyError, TypeError, ValueError) as error:
+        raise web.HTTPBadRequest(text=f"Invalid observation: {error}")
+
+    batcher: MicroBatcher = request.app[BATCHER_KEY]
+    probability = await batcher.predict(observation, birthday, observation_date)
+
+    # The report is written behind, the response does not wait for the database.
+    if observation_id is not None:
+        report = PreliminaryReportObject(
+            {
+                PreliminaryReport.OBSERVATION_ID.name: observation_id,
+                PreliminaryReport.PRELIMINARY_DIAGNOSIS.name: probability,
+                PreliminaryReport.REPORT_DATE.name: date.today(),
+            }
+        )
+        db: DataBaseInterface = request.app[DB_KEY]
+        await db.buffer_preliminary_report_data(report)
+
+    return web.json_response(
+        {PreliminaryReport.PRELIMINARY_DIAGNOSIS.name: probability}
+    )
+
+
+@routes.get("/metrics")
+async def metrics(request: Request) -> Response:
+    batcher: MicroBatcher = request.app[BATCHER_KEY]
+    reloader: ModelReloader = request.app[RELOADER_KEY]
+    learner: IncrementalLearner = request.app[LEARNER_KEY]
+    db: DataBaseInterface = request.app[DB_KEY]
+
+    return web.json_response(
+        {
+            "batcher": batcher.metrics(),
+            "model": reloader.metrics(),
+            "learner": learner.metrics(),
+            "reports": (
+                None if db.reports_buffer is None else db.reports_buffer.metrics()
+            ),
+        }
+    )
+
+
+@routes.post("/admin/reload")
+async def reload_model(request: Request) -> Response:
+    try:
+        body = await request.json() if request.can_read_body else {}
+    except json.JSONDecodeError as error:
+        raise web.HTTPBadRequest(text=f"Invalid reload request: {error}")
+    if not isinstance(body, dict):
+        raise web.HTTPBadRequest(text="Reload request should be a JSON object")
+
+    path = None
+    if "version" in body:
+        if not isinstance(body["version"], str):
+            raise web.HTTPBadRequest(text="Model version should be a string")
+
+        path = BUNDLES_PATH / body["version"]
+        if path.parent != BUNDLES_PATH or not path.is_dir():
+            raise web.HTTPNotFound(text=f"There isn't model version {body['version']}")
+
+    reloader: ModelReloader = request.app[RELOADER_KEY]
+    try:
+        await reloader.reload(path)
+    except Exception as error:
+        return web.json_response({"error": str(error)}, status=500)
+
+    return web.json_response(reloader.metrics())
+
+
 app = web.Application()
-app.on_startup.append(partial(create_db_interface, connections_count=6))
+app.on_startup.append(
+    partial(create_db_interface, connections_count=6, buffer_reports=True)
+)
+app.on_startup.append(partial(create_executor, kind="thread", workers=4))
 app.on_startup.append(partial(create_pipeline))
+app.on_startup.append(partial(create_batcher, max_batch_size=64, max_wait_ms=5))
+app.on_startup.append(partial(create_reloader, interval=30))
+app.on_startup.append(partial(create_learner, interval=60))
 
 app.middlewares.append(check_patient_id)
 
+app.on_cleanup.append(partial(destroy_learner))
+app.on_cleanup.append(partial(destroy_reloader))
+app.on_cleanup.append(partial(destroy_batcher))
+app.on_cleanup.append(partial(destroy_executor))
 app.on_cleanup.append(partial(destroy_db_interface))
 
 app.add_routes(routes)
-web.run_app(app, host="127.0.0.1", port=8000)
+
+if __name__ == "__main__":
+    web.run_app(app, host="127.0.0.1", port=8000)
@@ -5,29 +5,39 @@ from sklearn.metrics import accuracy_score, precision_score, recall_score
 from sklearn.model_selection import train_test_split
 
 from notation import Feature
+from bundle import ModelBundle
 from pipeline import (
     DBAdapter,
     LearnPipeline,
     ProductPipeline,
     save_model,
-    upload_model,
     RANDOM_STATE,
     TEST_SAMPLE_SIZE,
     MODELS_PATH,
+    BUNDLES_PATH,
     MAIN_MODEL,
 )
 
 
-def train_knn():
+def train_knn(backend: str = "exact", **backend_params):
     pipeline = LearnPipeline()
     X_train, X_test, y_train, y_test = pipeline.run()
 
     knn = KNeighborsClassifier()
-    knn.fit(X_train, y_train)
+    knn.fit(X_train.to_numpy(), y_train)
 
     save_model(MODELS_PATH / MAIN_MODEL, knn)
+    bundle = ModelBundle.from_fitted(
+        pipeline.preprocessor,
+        knn,
+        backend,
+        observation_ids=pipeline.observation_ids,
+        watermark=pipeline.watermark,
+        **backend_params,
+    )
+    bundle.save(BUNDLES_PATH)
 
-    pred = knn.predict(X_test)
+    pred = knn.predict(X_test.to_numpy())
     print(accuracy_score(y_test, pred))
     print(precision_score(y_test, pred))
     print(recall_score(y_test, pred))
@@ -48,9 +58,7 @@ def test_knn_model():
         random_state=RANDOM_STATE,
     )
 
-    knn: KNeighborsClassifier = upload_model(MODELS_PATH / MAIN_MODEL)
-
-    pred = knn.predict(X_test)
+    pred = pipeline.score(X_test.to_numpy()) > 0.5
     print(accuracy_score(y_test, pred))
     print(precision_score(y_test, pred))
     print(recall_score(y_test, pred))
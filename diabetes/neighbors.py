@@ -0,0 +1,456 @@
+"""
+Neighbour search backends for the served KNN model. Each backend keeps its
+state in plain arrays, so it can be stored in a model bundle and opened
+with mmap_mode.
+"""
+import numpy as np
+from sklearn.cluster import MiniBatchKMeans
+from sklearn.metrics import DistanceMetric
+from sklearn.neighbors import KNeighborsClassifier, KDTree, BallTree
+
+
+TRAIN_X = "train_x"
+TRAIN_POSITIVE = "train_positive"
+TRAIN_NORMS = "train_norms"
+
+
+def row_norms(X: np.ndarray) -> np.ndarray:
+    return np.einsum("ij,ij->i", X, X)
+
+
+def top_k(distances: np.ndarray, k: int) -> np.ndarray:
+    if distances.shape[1] <= k:
+        return np.broadcast_to(np.arange(distances.shape[1]), distances.shape)
+    return np.argpartition(distances, k - 1, axis=1)[:, :k]
+
+
+class NeighborsScorer(object):
+    """
+    Exact uniform neighbour vote with one float64 distance product over the
+    whole training matrix, without sklearn's per-call validation overhead.
+    """
+
+    backend = "exact"
+
+    def __init__(
+        self,
+        X: np.ndarray,
+        positive: np.ndarray,
+        n_neighbors: int,
+        squared_norms: np.ndarray = None,
+    ) -> None:
+        self.X = np.asarray(X)
+        self.positive = np.asarray(positive, dtype=np.float64)
+        self.n_neighbors = n_neighbors
+
+        if squared_norms is None:
+            squared_norms = row_norms(self.X)
+        self.squared_norms = np.asarray(squared_norms)
+
+        # Rows appended after training, searched exactly next to the index.
+        self.delta: NeighborsScorer = None
+
+    @classmethod
+    def build(
+        self,
+        X: np.ndarray,
+        positive: np.ndarray,
+        n_neighbors: int,
+        **params,
+    ) -> "NeighborsScorer":
+        """
+        Training time construction, may precompute an index.
+        """
+        return self(X, positive, n_neighbors, **params)
+
+    @classmethod
+    def from_model(
+        self,
+        model: KNeighborsClassifier,
+        **params,
+    ) -> "NeighborsScorer":
+        if model.weights != "uniform" or model.effective_metric_ != "euclidean":
+            raise ValueError("Only uniform euclidean KNN can be scored directly")
+
+        positive = model.classes_[model._y] == True
+        return self.build(model._fit_X, positive, model.n_neighbors, **params)
+
+    def arrays(self) -> dict[str, np.ndarray]:
+        return {
+            TRAIN_X: self.X,
+            TRAIN_POSITIVE: self.positive,
+            TRAIN_NORMS: self.squared_norms,
+        }
+
+    def params(self) -> dict:
+        return {}
+
+    @classmethod
+    def from_arrays(
+        self,
+        arrays: dict[str, np.ndarray],
+        n_neighbors: int,
+        **params,
+    ) -> "NeighborsScorer":
+        return self(
+            arrays[TRAIN_X],
+            arrays[TRAIN_POSITIVE],
+            n_neighbors,
+            squared_norms=arrays[TRAIN_NORMS],
+            **params,
+        )
+
+    def distances(self, values: np.ndarray) -> np.ndarray:
+        """
+        Squared euclidean distances up to the per-row constant |x|^2,
+        which does not change the neighbour order.
+        """
+        distances = values @ self.X.T
+        distances *= -2
+        distances += self.squared_norms
+        return distances
+
+    def kneighbors(self, values: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Distances, in the sense of NeighborsScorer.distances, and indexes
+        of the nearest training rows, in no particular order.
+        """
+        distances = self.distances(values)
+        nearest = top_k(distances, self.n_neighbors)
+        return np.take_along_axis(distances, nearest, axis=1), nearest
+
+    def append(self, X: np.ndarray, positive: np.ndarray) -> None:
+        """
+        Adds labeled rows without rebuilding the index. The delta segment
+        is replaced, never mutated, so a batch in flight keeps a consistent view.
+        """
+        X = np.asarray(X, dtype=np.float64)
+        positive = np.asarray(positive, dtype=np.float64)
+
+        delta = self.delta
+        if delta is not None:
+            X = np.vstack([delta.X, X])
+            positive = np.concatenate([delta.positive, positive])
+
+        self.delta = NeighborsScorer(X, positive, self.n_neighbors)
+
+    def predict_proba(self, values: np.ndarray) -> np.ndarray:
+        distances, nearest = self.kneighbors(values)
+        votes = self.positive[nearest]
+
+        delta = self.delta
+        if delta is not None:
+            delta_distances, delta_nearest = delta.kneighbors(values)
+            distances = np.hstack([distances, delta_distances])
+            votes = np.hstack([votes, delta.positive[delta_nearest]])
+
+            nearest = top_k(distances, self.n_neighbors)
+            votes = np.take_along_axis(votes, nearest, axis=1)
+
+        return votes.mean(axis=1)
+
+
+class BlockedNeighbors(NeighborsScorer):
+    """
+    Exact search over a float32 training matrix, scanned in blocks of rows,
+    so a batch of queries never materializes the full distance matrix.
+    block_size bounds the distances computed at once, in elements.
+    """
+
+    backend = "brute"
+
+    def __init__(
+        self,
+        X: np.ndarray,
+        positive: np.ndarray,
+        n_neighbors: int,
+        squared_norms: np.ndarray = None,
+        block_size: int = 2**24,
+    ) -> None:
+        X = np.asarray(X)
+        if X.dtype != np.float32:
+            X = np.ascontiguousarray(X, dtype=np.float32)
+
+        super().__init__(X, positive, n_neighbors, squared_norms)
+        self.block_size = block_size
+
+    def params(self) -> dict:
+        return {"block_size": self.block_size}
+
+    def kneighbors(self, values: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+        queries = np.asarray(values, dtype=np.float32)
+        k = self.n_neighbors
+
+        best_distances = np.empty((len(queries), 0), dtype=np.float32)
+        best_indexes = np.empty((len(queries), 0), dtype=np.int64)
+
+        rows = max(k, self.block_size // max(len(queries), 1))
+        for start in range(0, len(self.X), rows):
+            stop = start + rows
+
+            distances = queries @ self.X[start:stop].T
+            distances *= -2
+            distances += self.squared_norms[start:stop]
+
+            nearest = top_k(distances, k)
+            distances = np.take_along_axis(distances, nearest, axis=1)
+
+            best_distances = np.hstack([best_distances, distances])
+            best_indexes = np.hstack([best_indexes, nearest + start])
+
+            nearest = top_k(best_distances, k)
+            best_distances = np.take_along_axis(best_distances, nearest, axis=1)
+            best_indexes = np.take_along_axis(best_indexes, nearest, axis=1)
+
+        return best_distances, best_indexes
+
+
+class TreeNeighbors(NeighborsScorer):
+    """
+    Exact search through a space partitioning tree. The tree arrays are
+    stored in the bundle next to the training matrix and opened with it,
+    so loading a bundle does not rebuild the tree nor copy the matrix.
+    """
+
+    backend = "kd_tree"
+    tree_class = KDTree
+
+    TREE_INDEX = "tree_index"
+    TREE_NODE_DATA = "tree_node_data"
+    TREE_NODE_BOUNDS = "tree_node_bounds"
+    TREE_COUNTERS = "tree_counters"
+
+    def __init__(
+        self,
+        X: np.ndarray,
+        positive: np.ndarray,
+        n_neighbors: int,
+        squared_norms: np.ndarray = None,
+        leaf_size: int = 40,
+        tree_arrays: dict[str, np.ndarray] = None,
+    ) -> None:
+        super().__init__(X, positive, n_neighbors, squared_norms)
+
+        self.leaf_size = leaf_size
+        self.tree = None
+        if tree_arrays is not None:
+            self.tree = self._restore_tree(tree_arrays)
+        if self.tree is None:
+            self.tree = self.tree_class(self.X, leaf_size=leaf_size)
+
+    def _restore_tree(self, tree_arrays: dict[str, np.ndarray]):
+        """
+        Rebuilds the tree object around the stored arrays without copying
+        them. The tree state layout is private to sklearn, so a layout it
+        does not accept falls back to building the tree again.
+        """
+        counters = [int(counter) for counter in tree_arrays[self.TREE_COUNTERS]]
+        state = (
+            np.asarray(self.X, dtype=np.float64),
+            tree_arrays[self.TREE_INDEX],
+            tree_arrays[self.TREE_NODE_DATA],
+            tree_arrays[self.TREE_NODE_BOUNDS],
+            *counters,
+            DistanceMetric.get_metric("euclidean"),
+            None,
+        )
+
+        tree = self.tree_class.__new__(self.tree_class)
+        try:
+            tree.__setstate__(state)
+        except (TypeError, ValueError):
+            return None
+        return tree
+
+    def arrays(self) -> dict[str, np.ndarray]:
+        arrays = super().arrays()
+
+        # data, index, node data, node bounds, then the integer counters.
+        state = self.tree.__getstate__()
+        arrays[self.TREE_INDEX] = state[1]
+        arrays[self.TREE_NODE_DATA] = state[2]
+        arrays[self.TREE_NODE_BOUNDS] = state[3]
+        arrays[self.TREE_COUNTERS] = np.array(state[4:11], dtype=np.int64)
+        return arrays
+
+    def params(self) -> dict:
+        return {"leaf_size": self.leaf_size}
+
+    @classmethod
+    def from_arrays(
+        self,
+        arrays: dict[str, np.ndarray],
+        n_neighbors: int,
+        **params,
+    ) -> "TreeNeighbors":
+        tree_arrays = None
+        if self.TREE_INDEX in arrays:
+            tree_arrays = {
+                name: arrays[name]
+                for name in (
+                    self.TREE_INDEX,
+                    self.TREE_NODE_DATA,
+                    self.TREE_NODE_BOUNDS,
+                    self.TREE_COUNTERS,
+                )
+            }
+
+        return self(
+            arrays[TRAIN_X],
+            arrays[TRAIN_POSITIVE],
+            n_neighbors,
+            squared_norms=arrays[TRAIN_NORMS],
+            tree_arrays=tree_arrays,
+            **params,
+        )
+
+    def kneighbors(self, values: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+        k = min(self.n_neighbors, len(self.X))
+        distances, nearest = self.tree.query(values, k=k)
+
+        # The tree returns true distances, shift them to the |x|^2-free form.
+        distances **= 2
+        distances -= row_norms(np.asarray(values, dtype=np.float64))[:, None]
+        return distances, nearest
+
+
+class BallTreeNeighbors(TreeNeighbors):
+    backend = "ball_tree"
+    tree_class = BallTree
+
+
+class IVFNeighbors(NeighborsScorer):
+    """
+    Approximate search over an inverted file index: training rows are
+    grouped by k-means cluster, and a query only scans the rows of its
+    n_probe nearest clusters.
+    """
+
+    backend = "ivf"
+
+    CENTROIDS = "ivf_centroids"
+    OFFSETS = "ivf_offsets"
+
+    def __init__(
+        self,
+        X: np.ndarray,
+        positive: np.ndarray,
+        n_neighbors: int,
+        squared_norms: np.ndarray = None,
+        centroids: np.ndarray = None,
+        offsets: np.ndarray = None,
+        n_probe: int = 8,
+    ) -> None:
+        super().__init__(X, positive, n_neighbors, squared_norms)
+
+        self.centroids = np.asarray(centroids)
+        self.offsets = np.asarray(offsets)
+        self.n_probe = min(n_probe, len(self.centroids))
+
+        self._centroid_norms = row_norms(self.centroids)
+
+    @classmethod
+    def build(
+        self,
+        X: np.ndarray,
+        positive: np.ndarray,
+        n_neighbors: int,
+        n_lists: int = None,
+        n_probe: int = 8,
+        random_state: int = 42,
+    ) -> "IVFNeighbors":
+        X = np.asarray(X)
+        positive = np.asarray(positive)
+
+        if n_lists is None:
+            n_lists = max(1, int(np.sqrt(len(X))))
+
+        kmeans = MiniBatchKMeans(n_lists, random_state=random_state, n_init=3)
+        labels = kmeans.fit_predict(X)
+
+        order = np.argsort(labels, kind="stable")
+        offsets = np.searchsorted(labels[order], np.arange(n_lists + 1))
+
+        return self(
+            np.ascontiguousarray(X[order]),
+            positive[order],
+            n_neighbors,
+            centroids=kmeans.cluster_centers_,
+            offsets=offsets,
+            n_probe=n_probe,
+        )
+
+    def arrays(self) -> dict[str, np.ndarray]:
+        arrays = super().arrays()
+        arrays[self.CENTROIDS] = self.centroids
+        arrays[self.OFFSETS] = self.offsets
+        return arrays
+
+    def params(self) -> dict:
+        return {"n_probe": self.n_probe}
+
+    @classmethod
+    def from_arrays(
+        self,
+        arrays: dict[str, np.ndarray],
+        n_neighbors: int,
+        **params,
+    ) -> "IVFNeighbors":
+        return self(
+            arrays[TRAIN_X],
+            arrays[TRAIN_POSITIVE],
+            n_neighbors,
+            squared_norms=arrays[TRAIN_NORMS],
+            centroids=arrays[self.CENTROIDS],
+            offsets=arrays[self.OFFSETS],
+            **params,
+        )
+
+    def kneighbors(self, values: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+        k = min(self.n_neighbors, len(self.X))
+
+        distances = values @ self.centroids.T
+        distances *= -2
+        distances += self._centroid_norms
+        probes = top_k(distances, self.n_probe)
+
+        nearest = np.empty((len(values), k), dtype=np.int64)
+        nearest_distances = np.empty((len(values), k), dtype=np.float64)
+        for index, (value, clusters) in enumerate(zip(values, probes)):
+            candidates = np.concatenate(
+                [
+                    np.arange(self.offsets[cluster], self.offsets[cluster + 1])
+                    for cluster in clusters
+                ]
+            )
+            if len(candidates) < k:
+                candidates = np.arange(len(self.X))
+
+            distances = self.X[candidates] @ value
+            distances *= -2
+            distances += self.squared_norms[candidates]
+
+            best = np.argpartition(distances, k - 1)[:k]
+            nearest[index] = candidates[best]
+            nearest_distances[index] = distances[best]
+
+        return nearest_distances, nearest
+
+
+BACKENDS: dict[str, type[NeighborsScorer]] = {
+    NeighborsScorer.backend: NeighborsScorer,
+    BlockedNeighbors.backend: BlockedNeighbors,
+    TreeNeighbors.backend: TreeNeighbors,
+    BallTreeNeighbors.backend: BallTreeNeighbors,
+    IVFNeighbors.backend: IVFNeighbors,
+}
+
+
+def scorer_from_model(
+    model: KNeighborsClassifier,
+    backend: str = NeighborsScorer.backend,
+    **params,
+) -> NeighborsScorer:
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown neighbors backend '{backend}'")
+    return BACKENDS[backend].from_model(model, **params)
@@ -1,3 +1,4 @@
+import numpy as np
 from abc import ABCMeta
 from dataclasses import dataclass
 from typing import Optional
@@ -8,16 +9,31 @@ from pathlib import Path
 class Attribute(object):
     name: str
     type: str
+    # Column constraint of the CREATE statement, like NOT NULL or REFERENCES.
+    constraint: str = ""
+
+
+# Attributes of every Notation, collected from the class on first use.
+_KEYS: dict[type, list[Attribute]] = {}
 
 
 class Notation(ABCMeta):
     TABLE_NAME = "table_name"
+    # Table constraints of the CREATE statement, after the columns.
+    CONSTRAINTS: list[str] = []
+    VIEW = False
 
     @classmethod
     def get_keys(self) -> list[Attribute]:
-        items = self.__dict__.items()
-        items = [item[1] for item in items if isinstance(item[1], Attribute)]
-        return items
+        keys = _KEYS.get(self)
+        if keys is None:
+            keys = [
+                value
+                for value in self.__dict__.values()
+                if isinstance(value, Attribute)
+            ]
+            _KEYS[self] = keys
+        return list(keys)
 
 
 class DataSet(Notation):
@@ -35,24 +51,41 @@ class DataSet(Notation):
 class Patient(Notation):
     TABLE_NAME = "patient"
     PATIENT_ID = Attribute("patient_id", "SERIAL")
-    FIRST_NAME = Attribute("first_name", "VARCHAR(100)")
-    LAST_NAME = Attribute("last_name", "VARCHAR(100)")
+    FIRST_NAME = Attribute("first_name", "VARCHAR(100)", "NOT NULL")
+    LAST_NAME = Attribute("last_name", "VARCHAR(100)", "NOT NULL")
     PATRONYMIC = Attribute("patronymic", "VARCHAR(100)")
-    BIRTHDAY = Attribute("birthday_date", "DATE")
-    PHONE_NUMBER = Attribute("phone_number", "VARCHAR(12)")
-    GENDER = Attribute("gender", "CHAR(1)")
+    BIRTHDAY = Attribute("birthday_date", "DATE", "NOT NULL")
+    PHONE_NUMBER = Attribute("phone_number", "VARCHAR(12)", "NOT NULL")
+    GENDER = Attribute("gender", "CHAR(1)", "NOT NULL")
+
+    CONSTRAINTS = [
+        f"PRIMARY KEY ({PATIENT_ID.name})",
+        f"UNIQUE ({FIRST_NAME.name}, {LAST_NAME.name}, {PATRONYMIC.name}, "
+        f"{BIRTHDAY.name}, {PHONE_NUMBER.name})",
+    ]
 
 
 class Observation(Notation):
     TABLE_NAME = "observation"
-    PATIENT_ID = Attribute("patient_id", "INT")
+    PATIENT_ID = Attribute(
+        "patient_id",
+        "INT",
+        f"REFERENCES {Patient.TABLE_NAME} ({Patient.PATIENT_ID.name})",
+    )
     OBSERVATION_DATE = Attribute("observation_date", "DATE")
     OBSERVATION_ID = Attribute("observation_id", "SERIAL")
 
+    CONSTRAINTS = [f"PRIMARY KEY ({OBSERVATION_ID.name})"]
+
+
+OBSERVATION_REFERENCE = (
+    f"REFERENCES {Observation.TABLE_NAME} ({Observation.OBSERVATION_ID.name})"
+)
+
 
 class ObservationData(Notation):
     TABLE_NAME = "observation_data"
-    OBSERVATION_ID = Attribute("observation_id", "INT")
+    OBSERVATION_ID = Attribute("observation_id", "INT", OBSERVATION_REFERENCE)
     PREGNANCIES = Attribute("pregnancies", "INT")
     GLUCOSE = Attribute("glucose", "FLOAT")
     BLOOD_PRESSURE = Attribute("blood_pressure", "FLOAT")
@@ -61,17 +94,24 @@ class ObservationData(Notation):
     BMI = Attribute("bmi", "FLOAT")
     DIABETES_PEDIGREE_FUNCTION = Attribute("diabetes_predigree_function", "FLOAT")
 
+    CONSTRAINTS = [f"PRIMARY KEY ({OBSERVATION_ID.name})"]
+
 
 class FinalReport(Notation):
     TABLE_NAME = "final_report"
-    OBSERVATION_ID = Attribute("observation_id", "INT")
+    OBSERVATION_ID = Attribute("observation_id", "INT", OBSERVATION_REFERENCE)
     DIAGNOSIS = Attribute("diagnosis", "BOOL")
     REPORT_DATE = Attribute("final_report_date", "DATE")
 
+    CONSTRAINTS = [
+        f"PRIMARY KEY ({OBSERVATION_ID.name}) "
+        f"INCLUDE ({DIAGNOSIS.name}, {REPORT_DATE.name})"
+    ]
+
 
 class PreliminaryReport(Notation):
     TABLE_NAME = "preliminary_report"
-    OBSERVATION_ID = Attribute("observation_id", "INT")
+    OBSERVATION_ID = Attribute("observation_id", "INT", OBSERVATION_REFERENCE)
     PRELIMINARY_DIAGNOSIS = Attribute("preliminary_diagnosis", "FLOAT")
     REPORT_DATE = Attribute("preliminary_report_date", "DATE")
 
@@ -92,27 +132,34 @@ class Feature(Notation):
 
     AGE = Attribute("age", "NUMERIC")
 
-    @classmethod
-    @property
-    def numeric_columns(self) -> list[str]:
-        return [f.name for f in Feature.get_keys() if f.type == "NUMERIC"]
 
-    @classmethod
-    @property
-    def binary_columns(self) -> list[str]:
-        return [f.name for f in Feature.get_keys() if f.type == "BINARY"]
+# Plain class attributes, computed once: the pipelines read them on every call.
+Feature.numeric_columns = [f.name for f in Feature.get_keys() if f.type == "NUMERIC"]
+Feature.binary_columns = [f.name for f in Feature.get_keys() if f.type == "BINARY"]
+Feature.feature_columns = Feature.numeric_columns + Feature.binary_columns
+Feature.target = Feature.TARGET.name
 
-    @classmethod
-    @property
-    def feature_columns(self) -> list[str]:
-        numeric = self.numeric_columns
-        binary = self.binary_columns
-        return numeric + binary
 
-    @classmethod
-    @property
-    def target(self):
-        return self.TARGET.name
+class TrainFeatures(Notation):
+    TABLE_NAME = "train_features"
+    VIEW = True
+    PATIENT_ID = Attribute(Patient.PATIENT_ID.name, "INT")
+    OBSERVATION_ID = Attribute(Observation.OBSERVATION_ID.name, "INT")
+    OBSERVATION_DATE = Attribute(Observation.OBSERVATION_DATE.name, "DATE")
+
+    PREGNANCIES = Attribute(ObservationData.PREGNANCIES.name, "INT")
+    GLUCOSE = Attribute(ObservationData.GLUCOSE.name, "FLOAT")
+    BLOOD_PRESSURE = Attribute(ObservationData.BLOOD_PRESSURE.name, "FLOAT")
+    SKIN_THICKNESS = Attribute(ObservationData.SKIN_THICKNESS.name, "FLOAT")
+    INSULIN = Attribute(ObservationData.INSULIN.name, "FLOAT")
+    BMI = Attribute(ObservationData.BMI.name, "FLOAT")
+    DIABETES_PEDIGREE_FUNCTION = Attribute(
+        ObservationData.DIABETES_PEDIGREE_FUNCTION.name, "FLOAT"
+    )
+    AGE = Attribute(Feature.AGE.name, "INT")
+
+    DIAGNOSIS = Attribute(FinalReport.DIAGNOSIS.name, "BOOL")
+    REPORT_DATE = Attribute(FinalReport.REPORT_DATE.name, "DATE")
 
 
 class PageTemplate(Notation):
@@ -121,5 +168,121 @@ class PageTemplate(Notation):
     APPOINTMENT = DIR / "appointment.html"
 
 
+# NumPy dtypes of the SQL column types, other types are kept as objects.
+NUMPY_DTYPES = {
+    "INT": np.int64,
+    "SERIAL": np.int64,
+    "FLOAT": np.float64,
+    "BOOL": np.bool_,
+    "DATE": np.dtype("datetime64[D]"),
+}
+
+
+def numpy_dtype(attribute: Attribute) -> np.dtype:
+    return np.dtype(NUMPY_DTYPES.get(attribute.type, object))
+
+
+class TableSchema(object):
+    """
+    Columns, dtypes and statements of one Notation, rendered once.
+    columns keep the Notation order, which is the column order of
+    the created table and of every COPY. asyncpg renders COPY FROM STDIN
+    itself, from the table and copy_columns.
+    """
+
+    def __init__(self, notation: Notation) -> None:
+        self.notation = notation
+        self.table = notation.TABLE_NAME
+        self.keys = notation.get_keys()
+        self.columns = [key.name for key in self.keys]
+        self.dtypes = {key.name: numpy_dtype(key) for key in self.keys}
+
+        serials = [key for key in self.keys if key.type == "SERIAL"]
+        self.serial: Optional[Attribute] = serials[0] if serials else None
+        self.insert_keys = [key for key in self.keys if key.type != "SERIAL"]
+
+        self.select = f"SELECT {', '.join(self.columns)} FROM {self.table};"
+
+        # Views are only read, the view itself is created in database.py.
+        self.create = None
+        self.insert = None
+        self.copy_columns = None
+        if not notation.VIEW:
+            self.create = self.create_query()
+            self.insert = self.insert_query(self.insert_keys, self.serial)
+            self.copy_columns = tuple(self.columns)
+
+        self.batch_insert = None
+        self.reserve_ids = None
+        if self.serial is not None:
+            self.batch_insert = self.batch_insert_query(self.keys)
+            self.reserve_ids = self.reserve_ids_query(self.serial)
+
+    def create_query(self) -> str:
+        lines = [
+            f"{key.name} {key.type} {key.constraint}".rstrip() for key in self.keys
+        ]
+        lines += self.notation.CONSTRAINTS
+        definition = ",\n    ".join(lines)
+        return f"CREATE TABLE IF NOT EXISTS {self.table} (\n    {definition}\n);"
+
+    def insert_query(
+        self,
+        keys: list[Attribute],
+        returning: Attribute = None,
+    ) -> str:
+        """
+        A parameterized INSERT, rendered once so every call reuses the
+        statement prepared on the pooled connection.
+        """
+        columns = ", ".join(key.name for key in keys)
+        params = ", ".join(f"${index}" for index in range(1, len(keys) + 1))
+
+        query = f"INSERT INTO {self.table} ({columns}) VALUES ({params})"
+        if returning is not None:
+            query += f" RETURNING {returning.name}"
+        return query + ";"
+
+    def batch_insert_query(self, keys: list[Attribute]) -> str:
+        """
+        An INSERT over unnest()-ed arrays, one array per column. SERIAL ids
+        are passed in, reserved beforehand, since the order of RETURNING rows
+        is not guaranteed to follow the input.
+        """
+        columns = ", ".join(key.name for key in keys)
+        arrays = ", ".join(
+            f"${index}::{'INT' if key.type == 'SERIAL' else key.type}[]"
+            for index, key in enumerate(keys, start=1)
+        )
+
+        return f"""
+                INSERT INTO {self.table} ({columns})
+                SELECT {columns}
+                FROM unnest({arrays}) AS batch ({columns});
+                """
+
+    def reserve_ids_query(self, serial: Attribute) -> str:
+        return f"""
+                SELECT nextval(pg_get_serial_sequence(
+                    '{self.table}', '{serial.name}'
+                )) AS {serial.name}
+                FROM generate_series(1, $1);
+                """
+
+
+SCHEMAS: dict[type, TableSchema] = {
+    notation: TableSchema(notation)
+    for notation in (
+        Patient,
+        Observation,
+        ObservationData,
+        FinalReport,
+        PreliminaryReport,
+        TrainFeatures,
+    )
+}
+
+
 if __name__ == "__main__":
     print(Feature.get_keys())
+    # print(SCHEMAS[Patient].create)
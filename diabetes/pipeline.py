@@ -7,14 +7,25 @@ import pickle
 import pandas as pd
 import numpy as np
 from pathlib import Path
-from dateutil.relativedelta import relativedelta
+from datetime import date
 from sklearn.preprocessing import LabelEncoder, StandardScaler
 from sklearn.impute import SimpleImputer
 from sklearn.model_selection import train_test_split
+from typing import Iterator, Mapping, Sequence
+from asyncpg import Record
 from aiohttp.web_app import Application
 
 
-from database import DataBaseInterface
+from database import (
+    DataBaseInterface,
+    TRAIN_DATA_CHUNK_SIZE,
+    TRAIN_DATA_DTYPES,
+    TRAIN_FEATURES_DTYPES,
+)
+from util import DATE_DTYPE, count_years, count_years_one, records_to_arrays
+from preprocessing import Preprocessor
+from neighbors import NeighborsScorer
+from bundle import ModelBundle, latest_bundle
 from notation import (
     Patient,
     Feature,
@@ -29,13 +40,37 @@ RANDOM_STATE = 42
 TEST_SAMPLE_SIZE = 0.3
 
 MODELS_PATH = Path(__file__).parent / "models"
+BUNDLES_PATH = MODELS_PATH / "bundles"
 STD_PATH = "std_model.pickle"
 MEDIANS_PATH = "medians.pickle"
+PREPROCESSOR_PATH = "preprocessor.pickle"
 MAIN_MODEL = "main_model.pickle"
 
+SNAPSHOT_PATH = Path(__file__).parent / "snapshots" / "train_data.parquet"
+
 PIPELINE_KEY = "pipeline"
 
 
+def records_to_dataframe(
+    records: list[Record],
+    dtypes: dict[str, np.dtype] = None,
+) -> pd.DataFrame:
+    """
+    Builds the frame column by column, without a dict per record.
+    Columns in dtypes are filled into typed arrays, the others are inferred.
+    """
+    return pd.DataFrame(records_to_arrays(records, dtypes or {}), copy=False)
+
+
+def data_watermark(data: pd.DataFrame) -> tuple[int, date]:
+    """
+    Last observation_id and final_report_date of the training rows.
+    """
+    observation_id = int(data[Observation.OBSERVATION_ID.name].max())
+    report_date = pd.to_datetime(data[FinalReport.REPORT_DATE.name]).max()
+    return observation_id, report_date.date()
+
+
 class DBAdapter(object):
     def __init__(self) -> None:
         pass
@@ -45,22 +80,128 @@ class DBAdapter(object):
         await db.create_pool()
         return db
 
-    async def _get_all_data(self, db: DataBaseInterface):
-        return await db.get_data_to_train()
+    async def _get_all_data(
+        self,
+        db: DataBaseInterface,
+        since_observation_id: int = None,
+        since_report_date: date = None,
+        from_features: bool = False,
+    ) -> dict[str, np.ndarray]:
+        return await db.copy_data_to_train(
+            since_observation_id, since_report_date, from_features
+        )
 
-    async def main(self):
+    async def main(
+        self,
+        since_observation_id: int = None,
+        since_report_date: date = None,
+        from_features: bool = False,
+    ):
         db = await self._get_db_interface()
-        data = await self._get_all_data(db)
+        data = await self._get_all_data(
+            db, since_observation_id, since_report_date, from_features
+        )
 
         return data
 
-    def get_data(self) -> pd.DataFrame:
+    def get_data(
+        self,
+        since_observation_id: int = None,
+        since_report_date: date = None,
+        from_features: bool = False,
+    ) -> pd.DataFrame:
+        loop = asyncio.get_event_loop()
+
+        columns = loop.run_until_complete(
+            self.main(since_observation_id, since_report_date, from_features)
+        )
+
+        return pd.DataFrame(columns, copy=False)
+
+    def iter_data(
+        self,
+        chunk_size: int = TRAIN_DATA_CHUNK_SIZE,
+        from_features: bool = False,
+    ) -> Iterator[pd.DataFrame]:
+        loop = asyncio.get_event_loop()
+
+        db = loop.run_until_complete(self._get_db_interface())
+        chunks = db.iter_data_to_train(chunk_size, from_features)
+        dtypes = TRAIN_FEATURES_DTYPES if from_features else TRAIN_DATA_DTYPES
+
+        try:
+            while True:
+                try:
+                    records = loop.run_until_complete(chunks.__anext__())
+                except StopAsyncIteration:
+                    break
+
+                yield records_to_dataframe(records, dtypes)
+
+        finally:
+            loop.run_until_complete(chunks.aclose())
+            loop.run_until_complete(db.destroy_pool())
+
+    async def _refresh_features(self) -> None:
+        db = await self._get_db_interface()
+        try:
+            await db.refresh_train_features()
+        finally:
+            await db.destroy_pool()
+
+    def refresh_features(self) -> None:
         loop = asyncio.get_event_loop()
+        loop.run_until_complete(self._refresh_features())
+
 
-        data = loop.run_until_complete(self.main())
-        data = list(map(dict, data))
-        data = pd.DataFrame.from_dict(data)
+class TrainDataSnapshot(object):
+    """
+    Local Parquet copy of the training data. Each update fetches only rows
+    above the observation_id / final_report_date watermark and appends them.
+    """
 
+    def __init__(self, path: Path = SNAPSHOT_PATH) -> None:
+        self.path = path
+
+    def load(self) -> pd.DataFrame:
+        if not self.path.exists():
+            return None
+        data = pd.read_parquet(self.path)
+
+        # Snapshots written before the typed extraction keep dates as objects.
+        for column, dtype in TRAIN_DATA_DTYPES.items():
+            if dtype == DATE_DTYPE and data[column].dtype == object:
+                data[column] = pd.to_datetime(data[column])
+        return data
+
+    def save(self, data: pd.DataFrame) -> None:
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+
+        temporary = self.path.with_suffix(".tmp")
+        data.to_parquet(temporary, index=False)
+        temporary.replace(self.path)
+
+    def watermark(self, data: pd.DataFrame) -> tuple[int, date]:
+        return data_watermark(data)
+
+    def update(self, db_adapter: DBAdapter) -> pd.DataFrame:
+        data = self.load()
+
+        if data is None or data.empty:
+            data = db_adapter.get_data()
+        else:
+            fresh = db_adapter.get_data(*self.watermark(data))
+            if fresh.empty:
+                return data
+
+            data = pd.concat([data, fresh], ignore_index=True)
+            data = data.drop_duplicates(
+                subset=Observation.OBSERVATION_ID.name,
+                keep="last",
+                ignore_index=True,
+            )
+
+        self.save(data)
         return data
 
 
@@ -86,6 +227,10 @@ class LearnPipeline(object):
     def __init__(self) -> None:
         self.medians = None
         self.std_model = None
+        self.preprocessor = None
+
+        self.observation_ids = None
+        self.watermark = None
 
         self.nulls_exception = set(
             [
@@ -96,17 +241,12 @@ class LearnPipeline(object):
     def _save_model(self, path, model) -> None:
         return save_model(path, model)
 
-    def _count_age(self, row: pd.Series) -> pd.Series:
-        row[Feature.AGE.name] = relativedelta(
-            row[Observation.OBSERVATION_DATE.name],
-            row[Patient.BIRTHDAY.name],
-        ).years
-        return row
-
-    def isnull(self, value) -> bool:
-        if not value or value == 0:
-            return True
-        return False
+    def nulls_mask(self, values: np.ndarray, columns: list[str]) -> np.ndarray:
+        """
+        Zeros and NaNs count as missing, except in nulls_exception columns.
+        """
+        imputed = np.array([column not in self.nulls_exception for column in columns])
+        return ((values == 0) | np.isnan(values)) & imputed
 
     def setup_nulls(
         self,
@@ -121,18 +261,29 @@ class LearnPipeline(object):
             medians = data.median()
             self._save_model(MODELS_PATH / MEDIANS_PATH, medians)
 
-        for column in medians.index:
-            if column not in self.nulls_exception:
-                data.loc[
-                    data[column].apply(self.isnull),
-                    column,
-                ] = medians[column]
+        columns = list(medians.index)
+        values = data[columns].to_numpy(dtype=np.float64, copy=True)
+
+        fill = np.broadcast_to(medians.to_numpy(dtype=np.float64), values.shape)
+        np.copyto(values, fill, where=self.nulls_mask(values, columns))
+
+        data = data.copy()
+        data[columns] = values
 
         return data, medians
 
     def count_age(self, data: pd.DataFrame) -> pd.DataFrame:
-        data = data.apply(self._count_age, axis=1)
-        return data
+        """
+        Rows from the train_features view come with the age already counted.
+        """
+        if Feature.AGE.name in data:
+            return data
+
+        age = count_years(
+            data[Patient.BIRTHDAY.name],
+            data[Observation.OBSERVATION_DATE.name],
+        )
+        return data.assign(**{Feature.AGE.name: age})
 
     def extract_columns(self, data: pd.DataFrame) -> tuple[pd.DataFrame]:
         return data[
@@ -167,13 +318,67 @@ class LearnPipeline(object):
         data[numeric] = std_model.transform(data[numeric])
         return data, std_model
 
-    def run(self):
+    def _remember_seen(self, seen: pd.DataFrame) -> None:
+        """
+        Keeps which observations the model is trained on,
+        so incremental updates of its index skip them.
+        """
+        ids = seen[Observation.OBSERVATION_ID.name].to_numpy(dtype=np.int64)
+        self.observation_ids = np.unique(ids)
+        self.watermark = data_watermark(seen)
+
+    def _load_data(
+        self,
+        chunk_size: int = None,
+        use_snapshot: bool = False,
+        use_features: bool = False,
+    ) -> tuple[pd.DataFrame]:
+        """
+        use_features refreshes the train_features view and scans it
+        instead of joining the tables and counting the age here.
+        """
+        if use_snapshot and use_features:
+            raise ValueError("A snapshot keeps the joined rows, not the features view")
+
         db_adapter = DBAdapter()
-        data = db_adapter.get_data()
-        data = self.count_age(data)
+        seen_columns = [Observation.OBSERVATION_ID.name, FinalReport.REPORT_DATE.name]
+
+        if use_features:
+            db_adapter.refresh_features()
+
+        if use_snapshot or chunk_size is None:
+            if use_snapshot:
+                data = TrainDataSnapshot().update(db_adapter)
+            else:
+                data = db_adapter.get_data(from_features=use_features)
 
-        X = self.extract_columns(data)
-        y = data[[Feature.target]]
+            self._remember_seen(data[seen_columns])
+            data = self.count_age(data)
+            return self.extract_columns(data), data[[Feature.target]]
+
+        features, targets, seen = [], [], []
+        for chunk in db_adapter.iter_data(chunk_size, use_features):
+            seen.append(chunk[seen_columns])
+            chunk = self.count_age(chunk)
+            features.append(self.extract_columns(chunk))
+            targets.append(chunk[[Feature.target]])
+
+        if not features:
+            raise ValueError("There aren't any data to train")
+
+        self._remember_seen(pd.concat(seen, ignore_index=True))
+
+        X = pd.concat(features, ignore_index=True)
+        y = pd.concat(targets, ignore_index=True)
+        return X, y
+
+    def run(
+        self,
+        chunk_size: int = None,
+        use_snapshot: bool = False,
+        use_features: bool = False,
+    ):
+        X, y = self._load_data(chunk_size, use_snapshot, use_features)
 
         X_train, X_test, y_train, y_test = train_test_split(
             X,
@@ -188,32 +393,186 @@ class LearnPipeline(object):
         X_train, std_model = self.scale_features(X_train)
         X_test, _ = self.scale_features(X_test, std_model)
 
+        self.preprocessor = Preprocessor.from_fitted(
+            medians,
+            std_model,
+            Feature.numeric_columns,
+            self.nulls_exception,
+        )
+        self._save_model(MODELS_PATH / PREPROCESSOR_PATH, self.preprocessor)
+
         return X_train, X_test, y_train, y_test
 
 
 class ProductPipeline(LearnPipeline):
-    def __init__(self) -> None:
+    def __init__(self, bundle_path: Path = None) -> None:
         super().__init__()
 
-        self.medians = self._upload_model(MODELS_PATH / MEDIANS_PATH)
-        self.std_model = self._upload_model(MODELS_PATH / STD_PATH)
+        if bundle_path is None:
+            bundle_path = latest_bundle(BUNDLES_PATH)
+
+        if bundle_path is not None:
+            self._upload_bundle(bundle_path)
+        else:
+            self._upload_pickles()
+
+        columns = self.preprocessor.columns
+        self._age_index = columns.index(Feature.AGE.name)
+        self._observation_columns = [
+            column for column in columns if column != Feature.AGE.name
+        ]
+        self._observation_indexes = [
+            columns.index(column) for column in self._observation_columns
+        ]
+
+    @property
+    def generation(self) -> int:
+        """
+        Number of delta segments applied to the served index.
+        """
+        if self.bundle is None:
+            return 0
+        return self.bundle.generation
 
     def _upload_model(self, path):
         return upload_model(path)
 
-    def run(self, data: pd.DataFrame) -> tuple[pd.DataFrame]:
+    def _upload_bundle(self, path: Path) -> None:
+        self.bundle = ModelBundle.load(path)
+        self.bundle_path = path
+        self.version = self.bundle.version
+
+        self.preprocessor = self.bundle.preprocessor
+        self.scorer = self.bundle.scorer
+        self.model = None
+
+    def _upload_pickles(self) -> None:
+        """
+        Fallback for models saved before bundles were introduced.
+        """
+        self.bundle = None
+        self.bundle_path = None
+        self.version = None
+
+        self.preprocessor = self._upload_preprocessor()
+        self.model = self._upload_model(MODELS_PATH / MAIN_MODEL)
+        self._positive_index = list(self.model.classes_).index(True)
+
+        try:
+            self.scorer = NeighborsScorer.from_model(self.model)
+        except (AttributeError, ValueError):
+            self.scorer = None
+
+    def _upload_preprocessor(self) -> Preprocessor:
+        path = MODELS_PATH / PREPROCESSOR_PATH
+        if path.exists():
+            return self._upload_model(path)
+
+        self.medians = self._upload_model(MODELS_PATH / MEDIANS_PATH)
+        self.std_model = self._upload_model(MODELS_PATH / STD_PATH)
+
+        return Preprocessor.from_fitted(
+            self.medians,
+            self.std_model,
+            Feature.numeric_columns,
+            self.nulls_exception,
+        )
+
+    def run(self, data: pd.DataFrame) -> pd.DataFrame:
         data = self.count_age(data)
-        data = self.extract_columns(data)
 
-        data, _ = self.setup_nulls(data)
-        data, _ = self.scale_features(data)
+        values = self.preprocessor.to_array(data)
+        values = self.preprocessor.transform(values)
 
-        return data
+        return pd.DataFrame(
+            values,
+            index=data.index,
+            columns=self.preprocessor.columns,
+            copy=False,
+        )
+
+    def fill_row(
+        self,
+        row: np.ndarray,
+        observation: Mapping | Sequence,
+        birthday: date,
+        observation_date: date,
+    ) -> None:
+        """
+        Writes raw features of one observation into a row of the feature array.
+        A sequence should follow the ObservationData feature order.
+        """
+        if isinstance(observation, Mapping):
+            observation = [observation[column] for column in self._observation_columns]
+
+        row[self._observation_indexes] = observation
+        row[self._age_index] = count_years_one(birthday, observation_date)
+
+    def score(self, values: np.ndarray) -> np.ndarray:
+        """
+        Positive diagnosis probability for already preprocessed features.
+        """
+        if self.scorer is not None:
+            return self.scorer.predict_proba(values)
+        return self.model.predict_proba(values)[:, self._positive_index]
+
+    def predict_proba(self, values: np.ndarray) -> np.ndarray:
+        values = self.preprocessor.transform(values)
+        return self.score(values)
+
+    def predict_one(
+        self,
+        observation: Mapping | Sequence,
+        birthday: date,
+        observation_date: date,
+    ) -> float:
+        """
+        Preliminary diagnosis probability for one observation, without pandas.
+        """
+        values = np.empty((1, len(self.preprocessor.columns)), dtype=np.float64)
+        self.fill_row(values[0], observation, birthday, observation_date)
+
+        return float(self.predict_proba(values)[0])
+
+    def predict_many(
+        self,
+        observations: Sequence[tuple[Mapping | Sequence, date, date]],
+    ) -> np.ndarray:
+        """
+        Vectorized predict_one over (observation, birthday, observation_date).
+        """
+        values = np.empty(
+            (len(observations), len(self.preprocessor.columns)),
+            dtype=np.float64,
+        )
+        for row, observation in zip(values, observations):
+            self.fill_row(row, *observation)
+
+        return self.predict_proba(values)
+
+
+class PipelineSlot(object):
+    """
+    Holds the served pipeline. Readers take the reference once per batch,
+    so a swap never affects a batch that is already being scored.
+    """
+
+    def __init__(self, pipeline: ProductPipeline) -> None:
+        self.pipeline = pipeline
+
+    @property
+    def version(self) -> str:
+        return self.pipeline.version
+
+    def swap(self, pipeline: ProductPipeline) -> ProductPipeline:
+        previous, self.pipeline = self.pipeline, pipeline
+        return previous
 
 
 async def create_pipeline(app: Application) -> None:
-    pipeline = ProductPipeline()
-    app[PIPELINE_KEY] = pipeline
+    loop = asyncio.get_running_loop()
+    pipeline = await loop.run_in_executor(None, ProductPipeline)
+    app[PIPELINE_KEY] = PipelineSlot(pipeline)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,61 @@
+import numpy as np
+import pandas as pd
+from sklearn.preprocessing import StandardScaler
+
+
+class Preprocessor(object):
+    """
+    Fitted medians, nulls mask and scaler parameters compiled into flat
+    vectors. Transforms a contiguous float64 array in place with one
+    masked fill and one affine op.
+    """
+
+    def __init__(
+        self,
+        columns: list[str],
+        fill_values: np.ndarray,
+        fill_mask: np.ndarray,
+        mean: np.ndarray,
+        scale: np.ndarray,
+    ) -> None:
+        self.columns = list(columns)
+        self.fill_values = np.asarray(fill_values, dtype=np.float64)
+        self.fill_mask = np.asarray(fill_mask, dtype=bool)
+        self.mean = np.asarray(mean, dtype=np.float64)
+        self.scale = np.asarray(scale, dtype=np.float64)
+
+        self._multiplier = 1.0 / self.scale
+        self._offset = -self.mean * self._multiplier
+
+    @classmethod
+    def from_fitted(
+        self,
+        medians: pd.Series,
+        std_model: StandardScaler,
+        columns: list[str],
+        nulls_exception: set[str],
+    ) -> "Preprocessor":
+        scaled = getattr(std_model, "feature_names_in_", columns)
+        if list(scaled) != list(columns):
+            raise ValueError("Scaler should be fitted on the same columns")
+
+        return self(
+            columns=columns,
+            fill_values=medians[columns].to_numpy(dtype=np.float64),
+            fill_mask=[column not in nulls_exception for column in columns],
+            mean=std_model.mean_,
+            scale=std_model.scale_,
+        )
+
+    def to_array(self, data: pd.DataFrame) -> np.ndarray:
+        values = data[self.columns].to_numpy(dtype=np.float64, copy=True)
+        return np.ascontiguousarray(values)
+
+    def transform(self, values: np.ndarray) -> np.ndarray:
+        nulls = (values == 0) | np.isnan(values)
+        nulls &= self.fill_mask
+        np.copyto(values, self.fill_values, where=nulls)
+
+        np.multiply(values, self._multiplier, out=values)
+        np.add(values, self._offset, out=values)
+        return values
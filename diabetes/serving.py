@@ -0,0 +1,541 @@
+"""
+Scoring of HTTP requests: concurrent predictions are gathered into
+micro-batches and scored with one vectorized call.
+"""
+import asyncio
+import numpy as np
+from pathlib import Path
+from time import perf_counter
+from collections import Counter
+from concurrent.futures import Executor, ThreadPoolExecutor, ProcessPoolExecutor
+from datetime import date
+from typing import Any, Mapping
+from aiohttp.web_app import Application
+
+from database import DataBaseInterface, DB_KEY, TRAIN_DATA_DTYPES
+from notation import Patient, Observation, Feature
+from bundle import latest_bundle
+from pipeline import (
+    ProductPipeline,
+    PipelineSlot,
+    records_to_dataframe,
+    data_watermark,
+    PIPELINE_KEY,
+    BUNDLES_PATH,
+)
+
+
+BATCHER_KEY = "batcher"
+EXECUTOR_KEY = "executor"
+RELOADER_KEY = "reloader"
+LEARNER_KEY = "learner"
+
+MAX_BATCH_SIZE = 64
+MAX_WAIT_MS = 5
+
+EXECUTOR_KIND = "thread"
+EXECUTOR_WORKERS = 2
+
+RELOAD_INTERVAL = 30
+LEARN_INTERVAL = 60
+
+# Process workers keep the current and the previous model version,
+# so batches sent before a reload still finish on their own version.
+WORKER_VERSIONS = 2
+_worker_pipelines: dict[Path, ProductPipeline] = {}
+
+
+def parse_observation(body: Mapping[str, Any]) -> tuple:
+    observation = {
+        column: float(body[column])
+        for column in Feature.numeric_columns
+        if column != Feature.AGE.name
+    }
+    birthday = date.fromisoformat(body[Patient.BIRTHDAY.name])
+    observation_date = date.fromisoformat(body[Observation.OBSERVATION_DATE.name])
+
+    return observation, birthday, observation_date
+
+
+def batch_bucket(size: int) -> str:
+    bucket = 1
+    while bucket < size:
+        bucket *= 2
+    return f"<={bucket}"
+
+
+def _worker_pipeline(bundle_path: Path, generation: int = 0) -> ProductPipeline:
+    pipeline = _worker_pipelines.get(bundle_path)
+    if pipeline is not None:
+        if pipeline.generation < generation:
+            pipeline.bundle.load_deltas(bundle_path)
+        return pipeline
+
+    pipeline = ProductPipeline(bundle_path)
+    if len(_worker_pipelines) >= WORKER_VERSIONS:
+        del _worker_pipelines[next(iter(_worker_pipelines))]
+    _worker_pipelines[bundle_path] = pipeline
+
+    return pipeline
+
+
+def _init_worker() -> None:
+    _worker_pipeline(latest_bundle(BUNDLES_PATH))
+
+
+def _predict_in_worker(
+    bundle_path: Path,
+    generation: int,
+    observations: list[tuple],
+) -> list[float]:
+    pipeline = _worker_pipeline(bundle_path, generation)
+    return pipeline.predict_many(observations).tolist()
+
+
+class InferenceExecutor(object):
+    """
+    Runs scoring off the event loop. Threads share the pipeline of the app
+    (NumPy releases the GIL in the distance products); process workers
+    load their own pipeline once per model version, from its bundle,
+    and catch up with its delta segments when the generation grows.
+    """
+
+    def __init__(
+        self,
+        kind: str = EXECUTOR_KIND,
+        workers: int = EXECUTOR_WORKERS,
+    ) -> None:
+        self.kind = kind
+        self.workers = workers
+
+        if kind == "thread":
+            self._executor: Executor = ThreadPoolExecutor(workers)
+        elif kind == "process":
+            self._executor: Executor = ProcessPoolExecutor(
+                workers,
+                initializer=_init_worker,
+            )
+        else:
+            raise ValueError(f"Unknown executor kind '{kind}'")
+
+    async def predict_many(
+        self,
+        pipeline: ProductPipeline,
+        observations: list[tuple],
+    ) -> list[float]:
+        loop = asyncio.get_running_loop()
+
+        if self.kind == "process":
+            return await loop.run_in_executor(
+                self._executor,
+                _predict_in_worker,
+                pipeline.bundle_path,
+                pipeline.generation,
+                observations,
+            )
+
+        probabilities = await loop.run_in_executor(
+            self._executor, pipeline.predict_many, observations
+        )
+        return probabilities.tolist()
+
+    async def shutdown(self) -> None:
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(None, self._executor.shutdown)
+
+
+class MicroBatcher(object):
+    """
+    Collects requests for up to max_wait_ms or max_batch_size items and
+    scores them together. Whatever is already queued is taken at once,
+    so the wait window only applies while the service is not saturated.
+    Up to one batch per executor worker is scored at a time.
+    """
+
+    def __init__(
+        self,
+        slot: PipelineSlot,
+        executor: InferenceExecutor,
+        max_batch_size: int = MAX_BATCH_SIZE,
+        max_wait_ms: float = MAX_WAIT_MS,
+    ) -> None:
+        self.slot = slot
+        self.executor = executor
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+
+        self.histogram = Counter()
+        self.requests_count = 0
+
+        self._queue: asyncio.Queue = asyncio.Queue()
+        self._task: asyncio.Task = None
+
+        self._slots = asyncio.Semaphore(executor.workers)
+        self._scoring: set[asyncio.Task] = set()
+
+    def start(self) -> None:
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+
+        await asyncio.gather(*self._scoring, return_exceptions=True)
+
+        while not self._queue.empty():
+            *_, future = self._queue.get_nowait()
+            future.cancel()
+
+    async def predict(
+        self,
+        observation: Mapping[str, float],
+        birthday: date,
+        observation_date: date,
+    ) -> float:
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((observation, birthday, observation_date, future))
+        return await future
+
+    def _drain(self, batch: list) -> None:
+        while len(batch) < self.max_batch_size and not self._queue.empty():
+            batch.append(self._queue.get_nowait())
+
+    async def _collect(self) -> list:
+        batch = [await self._queue.get()]
+        self._drain(batch)
+
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.max_wait
+
+        while len(batch) < self.max_batch_size:
+            timeout = deadline - loop.time()
+            if timeout <= 0:
+                break
+
+            try:
+                batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+            self._drain(batch)
+
+        return batch
+
+    async def _score(self, batch: list) -> None:
+        observations = [item[:3] for item in batch]
+        pipeline = self.slot.pipeline
+
+        try:
+            probabilities = await self.executor.predict_many(pipeline, observations)
+        except Exception as error:
+            for *_, future in batch:
+                if not future.done():
+                    future.set_exception(error)
+            return
+
+        finally:
+            self._slots.release()
+
+        for (*_, future), probability in zip(batch, probabilities):
+            if not future.done():
+                future.set_result(probability)
+
+    async def _run(self) -> None:
+        while True:
+            await self._slots.acquire()
+            try:
+                batch = await self._collect()
+            except asyncio.CancelledError:
+                self._slots.release()
+                raise
+
+            self.histogram[batch_bucket(len(batch))] += 1
+            self.requests_count += len(batch)
+
+            task = asyncio.create_task(self._score(batch))
+            self._scoring.add(task)
+            task.add_done_callback(self._scoring.discard)
+
+    def metrics(self) -> dict:
+        return {
+            "requests": self.requests_count,
+            "batches": sum(self.histogram.values()),
+            "batch_size_histogram": dict(self.histogram),
+            "max_batch_size": self.max_batch_size,
+            "max_wait_ms": self.max_wait * 1000,
+        }
+
+
+def canary_batch(pipeline: ProductPipeline) -> np.ndarray:
+    """
+    Raw feature rows around the fitted medians, plus an all-missing row.
+    """
+    medians = np.asarray(pipeline.preprocessor.fill_values, dtype=np.float64)
+    return np.vstack([medians, medians * 0.5, medians * 1.5, np.zeros_like(medians)])
+
+
+class ModelReloader(object):
+    """
+    Loads a new model bundle off the event loop, validates it on a canary
+    batch and swaps it into the PipelineSlot. Runs from a background
+    watcher of the LATEST pointer or on demand.
+    """
+
+    def __init__(
+        self,
+        slot: PipelineSlot,
+        root: Path = BUNDLES_PATH,
+        interval: float = RELOAD_INTERVAL,
+    ) -> None:
+        self.slot = slot
+        self.root = root
+        self.interval = interval
+
+        self.reloads_count = 0
+        self.last_reload_ms: float = None
+        self.last_error: str = None
+
+        self._lock = asyncio.Lock()
+        self._task: asyncio.Task = None
+
+    def start(self) -> None:
+        self._task = asyncio.create_task(self._watch())
+
+    async def stop(self) -> None:
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+
+    def validate(self, pipeline: ProductPipeline) -> None:
+        current = self.slot.pipeline
+        if pipeline.preprocessor.columns != current.preprocessor.columns:
+            raise ValueError("New model expects other feature columns")
+
+        canary = canary_batch(current)
+        probabilities = pipeline.predict_proba(canary.copy())
+
+        if probabilities.shape != (len(canary),):
+            raise ValueError("New model returned a wrong number of predictions")
+        if not np.all((probabilities >= 0) & (probabilities <= 1)):
+            raise ValueError("New model returned probabilities out of [0, 1]")
+
+    def _load(self, path: Path) -> ProductPipeline:
+        pipeline = ProductPipeline(path)
+        self.validate(pipeline)
+        return pipeline
+
+    async def reload(self, path: Path = None) -> bool:
+        async with self._lock:
+            if path is None:
+                path = latest_bundle(self.root)
+            if path is None or path == self.slot.pipeline.bundle_path:
+                return False
+
+            start = perf_counter()
+            loop = asyncio.get_running_loop()
+            try:
+                pipeline = await loop.run_in_executor(None, self._load, path)
+            except Exception as error:
+                self.last_error = f"{path.name}: {error}"
+                raise
+
+            self.slot.swap(pipeline)
+
+            self.reloads_count += 1
+            self.last_reload_ms = (perf_counter() - start) * 1000
+            self.last_error = None
+
+            print(f"Reloaded model {pipeline.version}")
+            return True
+
+    async def _watch(self) -> None:
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.reload()
+            except Exception:
+                pass
+
+    def metrics(self) -> dict:
+        return {
+            "version": self.slot.version,
+            "reloads": self.reloads_count,
+            "last_reload_ms": self.last_reload_ms,
+            "last_error": self.last_error,
+        }
+
+
+class IncrementalLearner(object):
+    """
+    Polls the database for final reports after the watermark of the served
+    bundle, preprocesses them with its frozen medians and scaler, and appends
+    them to the neighbour index and to the bundle as a delta segment.
+    A full retrain is still needed to refresh the preprocessing statistics.
+    """
+
+    def __init__(
+        self,
+        slot: PipelineSlot,
+        db: DataBaseInterface,
+        interval: float = LEARN_INTERVAL,
+    ) -> None:
+        self.slot = slot
+        self.db = db
+        self.interval = interval
+
+        self.appended_rows = 0
+        self.last_update_ms: float = None
+        self.last_error: str = None
+
+        self._lock = asyncio.Lock()
+        self._task: asyncio.Task = None
+
+    def start(self) -> None:
+        self._task = asyncio.create_task(self._watch())
+
+    async def stop(self) -> None:
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+
+    def _append(self, pipeline: ProductPipeline, records: list) -> int:
+        bundle = pipeline.bundle
+
+        data = records_to_dataframe(records, TRAIN_DATA_DTYPES)
+        watermark = data_watermark(data)
+
+        observation_ids = data[Observation.OBSERVATION_ID.name].to_numpy(np.int64)
+        fresh = ~bundle.is_known(observation_ids)
+        if not fresh.any():
+            bundle.watermark = watermark
+            return 0
+
+        data = data[fresh]
+        values = pipeline.run(data).to_numpy()
+        positive = data[Feature.target].to_numpy(dtype=bool)
+
+        bundle.append(
+            pipeline.bundle_path,
+            values,
+            positive,
+            observation_ids[fresh],
+            watermark,
+        )
+        return len(data)
+
+    async def update(self) -> int:
+        """
+        Returns the number of appended observations.
+        """
+        async with self._lock:
+            pipeline = self.slot.pipeline
+            if pipeline.bundle is None or not pipeline.bundle.incremental:
+                return 0
+
+            start = perf_counter()
+            records = await self.db.get_data_to_train(*pipeline.bundle.watermark)
+            if not records:
+                return 0
+
+            loop = asyncio.get_running_loop()
+            try:
+                appended = await loop.run_in_executor(
+                    None, self._append, pipeline, records
+                )
+            except Exception as error:
+                self.last_error = f"{pipeline.version}: {error}"
+                raise
+
+            self.appended_rows += appended
+            self.last_update_ms = (perf_counter() - start) * 1000
+            self.last_error = None
+
+            if appended:
+                print(f"Appended {appended} observations to model {pipeline.version}")
+            return appended
+
+    async def _watch(self) -> None:
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.update()
+            except Exception:
+                pass
+
+    def metrics(self) -> dict:
+        return {
+            "generation": self.slot.pipeline.generation,
+            "appended_rows": self.appended_rows,
+            "last_update_ms": self.last_update_ms,
+            "last_error": self.last_error,
+        }
+
+
+async def create_executor(
+    app: Application,
+    kind: str = EXECUTOR_KIND,
+    workers: int = EXECUTOR_WORKERS,
+) -> None:
+    app[EXECUTOR_KEY] = InferenceExecutor(kind, workers)
+
+
+async def destroy_executor(app: Application) -> None:
+    executor: InferenceExecutor = app[EXECUTOR_KEY]
+    await executor.shutdown()
+
+
+async def create_batcher(
+    app: Application,
+    max_batch_size: int = MAX_BATCH_SIZE,
+    max_wait_ms: float = MAX_WAIT_MS,
+) -> None:
+    batcher = MicroBatcher(
+        app[PIPELINE_KEY],
+        app[EXECUTOR_KEY],
+        max_batch_size,
+        max_wait_ms,
+    )
+    batcher.start()
+
+    app[BATCHER_KEY] = batcher
+
+
+async def destroy_batcher(app: Application) -> None:
+    batcher: MicroBatcher = app[BATCHER_KEY]
+    await batcher.stop()
+
+
+async def create_reloader(
+    app: Application,
+    interval: float = RELOAD_INTERVAL,
+) -> None:
+    reloader = ModelReloader(app[PIPELINE_KEY], interval=interval)
+    reloader.start()
+
+    app[RELOADER_KEY] = reloader
+
+
+async def destroy_reloader(app: Application) -> None:
+    reloader: ModelReloader = app[RELOADER_KEY]
+    await reloader.stop()
+
+
+async def create_learner(
+    app: Application,
+    interval: float = LEARN_INTERVAL,
+) -> None:
+    learner = IncrementalLearner(app[PIPELINE_KEY], app[DB_KEY], interval)
+    learner.start()
+
+    app[LEARNER_KEY] = learner
+
+
+async def destroy_learner(app: Application) -> None:
+    learner: IncrementalLearner = app[LEARNER_KEY]
+    await learner.stop()
@@ -3,6 +3,7 @@ import random
 import asyncio
 import pandas as pd
 import numpy as np
+import pyarrow as pa
 from pathlib import Path
 from collections import namedtuple
 from russian_names import RussianNames
@@ -15,9 +16,72 @@ from notation import (
     Attribute,
     Notation,
     ObservationData,
+    SCHEMAS,
 )
-from datetime import datetime, timedelta
-from dateutil.relativedelta import relativedelta
+from calendar import isleap
+from datetime import date, datetime, time
+from typing import Iterable
+
+
+NS_PER_DAY = 24 * 60 * 60 * 10**9
+
+
+def _anniversary_key(
+    dates: pd.DatetimeIndex,
+    days: np.ndarray,
+) -> np.ndarray:
+    time = (dates - dates.normalize()).to_numpy().astype("timedelta64[ns]")
+    key = dates.month.to_numpy(np.int64) * 32 + days.astype(np.int64)
+    return key * NS_PER_DAY + time.astype(np.int64)
+
+
+def count_years(start, end) -> np.ndarray:
+    """
+    Vectorized relativedelta(end, start).years over datetime columns.
+    Like relativedelta, a February 29 start reaches its anniversary
+    on February 28 of a non-leap year.
+    """
+    start = pd.DatetimeIndex(pd.to_datetime(start))
+    end = pd.DatetimeIndex(pd.to_datetime(end))
+
+    years = end.year.to_numpy(np.int64) - start.year.to_numpy(np.int64)
+
+    start_days = start.day.to_numpy()
+    leap_day = (start.month == 2) & (start_days == 29) & ~end.is_leap_year
+    start_days = np.where(leap_day, 28, start_days)
+
+    start_key = _anniversary_key(start, start_days)
+    end_key = _anniversary_key(end, end.day.to_numpy())
+
+    forward = end.to_numpy() >= start.to_numpy()
+    return np.where(
+        forward,
+        years - (end_key < start_key),
+        years + (end_key > start_key),
+    )
+
+
+def _time_of(value: date) -> time:
+    return value.time() if isinstance(value, datetime) else time()
+
+
+def count_years_one(start: date, end: date) -> int:
+    """
+    Scalar count_years for a single pair of dates, without pandas.
+    """
+    years = end.year - start.year
+
+    start_day = start.day
+    if start.month == 2 and start_day == 29 and not isleap(end.year):
+        start_day = 28
+
+    start_key = (start.month, start_day, _time_of(start))
+    end_key = (end.month, end.day, _time_of(end))
+
+    forward = (end.toordinal(), _time_of(end)) >= (start.toordinal(), _time_of(start))
+    if forward:
+        return years - (end_key < start_key)
+    return years + (end_key > start_key)
 
 
 PersonalInfo = namedtuple(
@@ -25,6 +89,29 @@ PersonalInfo = namedtuple(
 )
 
 
+def dataframe_to_records(
+    dataframe: pd.DataFrame,
+    notation: Notation,
+) -> tuple[list[str], list[tuple]]:
+    keys = [key for key in SCHEMAS[notation].keys if key.name in dataframe.columns]
+    if len(keys) == 0:
+        raise ValueError(f"In dataframe there aren't any key from {notation.__name__}")
+
+    columns = [key.name for key in keys]
+    values = []
+    for key in keys:
+        column = dataframe[key.name]
+        if key.type == "DATE":
+            column = pd.to_datetime(column).dt.date
+        elif key.type in ("INT", "SERIAL"):
+            column = column.astype("int64")
+        elif key.type == "BOOL":
+            column = column.astype(bool)
+        values.append(column.tolist())
+
+    return columns, list(zip(*values))
+
+
 class EntityObject(dict):
     notation = Notation
     _allowed_keys = set([key.name for key in notation.get_keys()])
@@ -50,18 +137,11 @@ class EntityObject(dict):
         if len(self._allowed_keys) == 0:
             raise ValueError(f"There aren't any key in {self.__class__.__name__}")
 
-        columns = set(list(dataframe.columns))
-        keys = list(self._allowed_keys.intersection(columns))
-        if len(keys) == 0:
-            raise ValueError(
-                f"In dataframe there aren't any key from {self.__class__.__name__}"
-            )
-
-        subset = dataframe[keys].to_records(index=False)
+        keys, records = dataframe_to_records(dataframe, self.notation)
         items = list(
             map(
-                lambda sub: self.from_keys_and_values(keys, sub),
-                subset,
+                lambda record: self.from_keys_and_values(keys, record),
+                records,
             )
         )
         return items
@@ -69,27 +149,321 @@ class EntityObject(dict):
 
 class PatientObject(EntityObject):
     notation = Patient
-    _allowed_keys = set([key.name for key in notation.get_keys()])
+    _allowed_keys = frozenset(SCHEMAS[notation].columns)
 
 
 class ObservationObject(EntityObject):
     notation = Observation
-    _allowed_keys = set([key.name for key in notation.get_keys()])
+    _allowed_keys = frozenset(SCHEMAS[notation].columns)
 
 
 class ObservationDataObject(EntityObject):
     notation = ObservationData
-    _allowed_keys = set([key.name for key in notation.get_keys()])
+    _allowed_keys = frozenset(SCHEMAS[notation].columns)
 
 
 class FinalReportObject(EntityObject):
     notation = FinalReport
-    _allowed_keys = set([key.name for key in notation.get_keys()])
+    _allowed_keys = frozenset(SCHEMAS[notation].columns)
 
 
 class PreliminaryReportObject(EntityObject):
     notation = PreliminaryReport
-    _allowed_keys = set([key.name for key in notation.get_keys()])
+    _allowed_keys = frozenset(SCHEMAS[notation].columns)
+
+
+class EntityRecord(object):
+    """
+    One row of a Notation without a dict: values live in slots named after
+    the columns, and are read and written by column name like EntityObject.
+    """
+
+    __slots__ = ()
+    notation = Notation
+
+    def __init__(self, **values) -> None:
+        for key in self.__slots__:
+            setattr(self, key, values.pop(key, None))
+
+        if values:
+            raise ValueError(
+                f"{self.__class__.__name__} has no attribute '{next(iter(values))}'"
+            )
+
+    def __getitem__(self, key):
+        if key not in self.__slots__:
+            raise ValueError(f"{self.__class__.__name__} has no attribute '{key}'")
+        return getattr(self, key)
+
+    def __setitem__(self, key, value):
+        if key not in self.__slots__:
+            raise ValueError(f"{self.__class__.__name__} has no attribute '{key}'")
+        setattr(self, key, value)
+
+    def values(self, keys: list[Attribute]) -> tuple:
+        return tuple(getattr(self, key.name) for key in keys)
+
+
+class PatientRecord(EntityRecord):
+    __slots__ = tuple(SCHEMAS[Patient].columns)
+    notation = Patient
+
+
+class ObservationRecord(EntityRecord):
+    __slots__ = tuple(SCHEMAS[Observation].columns)
+    notation = Observation
+
+
+class ObservationDataRecord(EntityRecord):
+    __slots__ = tuple(SCHEMAS[ObservationData].columns)
+    notation = ObservationData
+
+
+class FinalReportRecord(EntityRecord):
+    __slots__ = tuple(SCHEMAS[FinalReport].columns)
+    notation = FinalReport
+
+
+class PreliminaryReportRecord(EntityRecord):
+    __slots__ = tuple(SCHEMAS[PreliminaryReport].columns)
+    notation = PreliminaryReport
+
+
+class EntityBatch(object):
+    """
+    Rows of a Notation as one typed NumPy array per column. Columns of
+    a DataFrame that already have the right dtype are taken without a copy.
+    """
+
+    notation = Notation
+    record_type = EntityRecord
+
+    def __init__(self, columns: dict[str, np.ndarray]) -> None:
+        self._columns: dict[str, np.ndarray] = {}
+        self._length = 0
+
+        for name, values in columns.items():
+            self[name] = values
+
+    @classmethod
+    def from_dataframe(self, dataframe: pd.DataFrame) -> "EntityBatch":
+        schema = SCHEMAS[self.notation]
+
+        columns = {}
+        for key in schema.keys:
+            if key.name not in dataframe.columns:
+                continue
+
+            column = dataframe[key.name]
+            if key.type == "DATE":
+                column = pd.to_datetime(column)
+            columns[key.name] = column.to_numpy(
+                dtype=schema.dtypes[key.name], copy=False
+            )
+
+        if len(columns) == 0:
+            raise ValueError(
+                f"In dataframe there aren't any key from {self.notation.__name__}"
+            )
+        return self(columns)
+
+    def __len__(self) -> int:
+        return self._length
+
+    def __getitem__(self, key: str) -> np.ndarray:
+        if key not in self._columns:
+            raise ValueError(f"{self.__class__.__name__} has no column '{key}'")
+        return self._columns[key]
+
+    def __setitem__(self, key: str, values) -> None:
+        """
+        Sets a column, for example ids returned by the database.
+        """
+        dtypes = SCHEMAS[self.notation].dtypes
+        if key not in dtypes:
+            raise ValueError(f"{self.__class__.__name__} has no attribute '{key}'")
+
+        column = np.asarray(values, dtype=dtypes[key])
+        if self._columns and len(column) != self._length:
+            raise ValueError("Columns of a batch should have the same length")
+
+        self._columns[key] = column
+        self._length = len(column)
+
+    def __contains__(self, key: str) -> bool:
+        return key in self._columns
+
+    def columns(self, keys: list[Attribute] = None) -> list[str]:
+        """
+        Names of the present columns, in the Notation order or the keys order.
+        """
+        if keys is None:
+            keys = SCHEMAS[self.notation].keys
+        return [key.name for key in keys if key.name in self._columns]
+
+    def column_values(self, keys: list[Attribute] = None) -> list[list]:
+        """
+        Columns as lists of Python values, for asyncpg array parameters.
+        datetime64[D] values become datetime.date. Every one of keys is required.
+        """
+        names = self.columns() if keys is None else [key.name for key in keys]
+        return [self[name].tolist() for name in names]
+
+    def records(self, keys: list[Attribute] = None) -> list[tuple]:
+        """
+        Rows as tuples of Python values, for COPY and executemany.
+        """
+        return list(zip(*self.column_values(keys)))
+
+    def to_records(self) -> list[EntityRecord]:
+        names = self.columns()
+        return [
+            self.record_type(**dict(zip(names, values))) for values in self.records()
+        ]
+
+    def record(self, index: int) -> EntityRecord:
+        return self.record_type(
+            **{
+                name: column[index : index + 1].tolist()[0]
+                for name, column in self._columns.items()
+            }
+        )
+
+
+class PatientBatch(EntityBatch):
+    notation = Patient
+    record_type = PatientRecord
+
+
+class ObservationBatch(EntityBatch):
+    notation = Observation
+    record_type = ObservationRecord
+
+
+class ObservationDataBatch(EntityBatch):
+    notation = ObservationData
+    record_type = ObservationDataRecord
+
+
+class FinalReportBatch(EntityBatch):
+    notation = FinalReport
+    record_type = FinalReportRecord
+
+
+class PreliminaryReportBatch(EntityBatch):
+    notation = PreliminaryReport
+    record_type = PreliminaryReportRecord
+
+
+DATE_DTYPE = np.dtype("datetime64[D]")
+EPOCH_ORDINAL = date(1970, 1, 1).toordinal()
+# Ordinal of a NULL date, NaT once the epoch is subtracted.
+NULL_ORDINAL = np.iinfo(np.int64).min + EPOCH_ORDINAL
+
+
+def values_to_array(values: Iterable, count: int, dtype: np.dtype) -> np.ndarray:
+    """
+    Fills an array of count elements straight from Python values.
+    None becomes NaN in float columns and NaT in date columns.
+    """
+    dtype = np.dtype(dtype)
+    if dtype != DATE_DTYPE:
+        return np.fromiter(values, dtype, count=count)
+
+    # date.toordinal is an order of magnitude faster than NumPy's date parsing.
+    ordinals = np.fromiter(
+        (NULL_ORDINAL if value is None else value.toordinal() for value in values),
+        np.int64,
+        count=count,
+    )
+    ordinals -= EPOCH_ORDINAL
+    return ordinals.view(DATE_DTYPE)
+
+
+def records_to_arrays(
+    records: list,
+    dtypes: dict[str, np.dtype],
+) -> dict[str, np.ndarray | list]:
+    """
+    Columns of asyncpg records, typed by dtypes, without a dict per record.
+    Columns without a dtype are kept as lists of Python values.
+    """
+    if not records:
+        return {}
+
+    columns = {}
+    for index, name in enumerate(records[0].keys()):
+        values = (record[index] for record in records)
+        if name in dtypes:
+            columns[name] = values_to_array(values, len(records), dtypes[name])
+        else:
+            columns[name] = list(values)
+    return columns
+
+
+PG_COPY_SIGNATURE = b"PGCOPY\n\xff\r\n\x00"
+PG_COPY_TRAILER = b"\xff\xff"
+PG_EPOCH = np.datetime64("2000-01-01", "D")
+PG_DATE_INFINITY = 2**31 - 1
+
+# Binary COPY wire types of the dtypes the columns are read into.
+COPY_WIRE_DTYPES = {
+    np.dtype(np.int64): np.dtype(">i8"),
+    np.dtype(np.float64): np.dtype(">f8"),
+    np.dtype(np.float32): np.dtype(">f4"),
+    np.dtype(np.bool_): np.dtype("?"),
+    DATE_DTYPE: np.dtype(">i4"),
+}
+
+
+def parse_binary_copy(
+    data: bytes,
+    dtypes: dict[str, np.dtype],
+) -> dict[str, np.ndarray]:
+    """
+    Reads a binary COPY stream of fixed width rows as one structured array
+    over the buffer, so no Python object is built per value. Columns follow
+    dtypes, without NULLs; the 'infinity' date stands for NULL and reads as NaT.
+    """
+    data = memoryview(data)
+    if bytes(data[: len(PG_COPY_SIGNATURE)]) != PG_COPY_SIGNATURE:
+        raise ValueError("Not a binary COPY stream")
+    if bytes(data[-len(PG_COPY_TRAILER) :]) != PG_COPY_TRAILER:
+        raise ValueError("Binary COPY stream is truncated")
+
+    # Signature, flags, then the header extension with its length.
+    header = len(PG_COPY_SIGNATURE) + 4
+    extension = int.from_bytes(data[header : header + 4], "big")
+    body = data[header + 4 + extension : -len(PG_COPY_TRAILER)]
+
+    fields = [("_count", ">i2")]
+    for index, (name, dtype) in enumerate(dtypes.items()):
+        fields.append((f"_length_{index}", ">i4"))
+        fields.append((name, COPY_WIRE_DTYPES[np.dtype(dtype)]))
+    row = np.dtype(fields)
+
+    if len(body) % row.itemsize:
+        raise ValueError("Binary COPY rows are not of the width of dtypes")
+    rows = np.frombuffer(body, dtype=row)
+
+    if (rows["_count"] != len(dtypes)).any():
+        raise ValueError(f"Binary COPY rows should have {len(dtypes)} columns")
+
+    columns = {}
+    for index, (name, dtype) in enumerate(dtypes.items()):
+        wire = row.fields[name][0]
+        if (rows[f"_length_{index}"] != wire.itemsize).any():
+            raise ValueError(f"Column '{name}' has NULLs or an unexpected type")
+
+        values = rows[name]
+        if np.dtype(dtype) == DATE_DTYPE:
+            column = PG_EPOCH + values.astype("timedelta64[D]")
+            column[values == PG_DATE_INFINITY] = np.datetime64("NaT")
+        else:
+            column = values.astype(dtype)
+        columns[name] = column
+
+    return columns
 
 
 class RussianPhoneNumber(object):
@@ -112,11 +486,43 @@ class RussianPhoneNumber(object):
 
         return country + operator + number
 
+    def generate_phone_numbers(
+        self,
+        rng: np.random.Generator,
+        count: int,
+    ) -> pd.arrays.ArrowStringArray:
+        """
+        Vectorized generate_phone_number. The digits are built as one int64
+        and cast to Arrow strings, without a Python object per phone.
+        """
+        operators = np.array(self._operators, dtype=np.int64)
+        operator = rng.choice(operators, count)
+        number = rng.integers(1000000, 9999999, count, endpoint=True)
+
+        phone = pa.array(8 * 10**10 + operator * 10**7 + number).cast(pa.string())
+        return pd.arrays.ArrowStringArray(phone)
+
+
+# Persons drawn from RussianNames once, rows pick their names from the pool.
+NAME_POOL_SIZE = 2000
+# The age self-check runs on a sample of large generated frames.
+CHECK_AGE_ROWS = 100_000
+
 
 class PreviousDataGenerator(object):
-    def __init__(self) -> None:
+    """
+    Synthetic history around the rows of diabetes.csv. With n_rows or
+    scale_factor the rows are resampled, so any size can be generated.
+    A seed makes the data reproducible for the same end_date.
+    """
+
+    def __init__(self, seed: int = None) -> None:
+        self.seed = seed
+        self._rng = np.random.default_rng(seed)
+
         self._phone_generator = RussianPhoneNumber()
-        self._name_generator = RussianNames(gender=0)
+        self._name_generator = RussianNames(gender=0, output_type="tuple", seed=seed)
+        self._name_pool: tuple[np.ndarray] = None
 
     def _read_data(self):
         return pd.read_csv(Path(__file__).parent / "diabetes.csv")
@@ -135,64 +541,106 @@ class PreviousDataGenerator(object):
 
         return data.rename(mapper, axis=1)
 
-    def _get_personal_info(self, row: pd.Series) -> pd.Series:
-        (
-            row[Patient.FIRST_NAME.name],
-            row[Patient.PATRONYMIC.name],
-            row[Patient.LAST_NAME.name],
-        ) = self._name_generator.get_person().split()
-        row[Patient.PHONE_NUMBER.name] = self._phone_generator.generate_phone_number()
-
-        return row
-
-    def _calculate_birthday(self, row: pd.Series) -> pd.Series:
-        age = row[DataSet.AGE.name]
-        obs_date = row[Observation.OBSERVATION_DATE.name]
-        row[Patient.BIRTHDAY.name] = obs_date - timedelta(
-            days=random.randint(age * 365 + 30, (age + 1) * 365 - 30)
+    def _resample(self, data: pd.DataFrame, n_rows: int) -> pd.DataFrame:
+        sample = self._rng.integers(0, len(data), n_rows)
+        return data.iloc[sample].reset_index(drop=True)
+
+    def _get_name_pool(self) -> tuple[np.ndarray]:
+        if self._name_pool is None:
+            persons = [self._name_generator.get_person() for _ in range(NAME_POOL_SIZE)]
+            self._name_pool = tuple(
+                pd.unique(np.array(column, dtype=object)) for column in zip(*persons)
+            )
+        return self._name_pool
+
+    def _get_personal_info(self, data: pd.DataFrame) -> pd.DataFrame:
+        """
+        First name, patronymic and last name are drawn independently, so the
+        pool gives NAME_POOL_SIZE ** 3 combinations. They are categoricals
+        over the pool, codes only, whatever the number of rows.
+        """
+        count = len(data)
+        columns = [
+            Patient.FIRST_NAME.name,
+            Patient.PATRONYMIC.name,
+            Patient.LAST_NAME.name,
+        ]
+        for column, pool in zip(columns, self._get_name_pool()):
+            codes = self._rng.integers(0, len(pool), count)
+            data[column] = pd.Categorical.from_codes(codes, categories=pool)
+
+        data[Patient.PHONE_NUMBER.name] = self._phone_generator.generate_phone_numbers(
+            self._rng, count
         )
-        return row
+        return data
 
-    def _calculate_report_date(self, row: pd.Series) -> pd.Series:
-        obs_date = row[Observation.OBSERVATION_DATE.name]
-        row[FinalReport.REPORT_DATE.name] = obs_date + timedelta(
-            days=random.randint(1, 15)
+    def _determine_dates(
+        self,
+        data: pd.DataFrame,
+        end_date: date = None,
+    ) -> pd.DataFrame:
+        """
+        Observations in the current month up to end_date, birthdays matching
+        the age of the row, final reports one to fifteen days later.
+        """
+        if end_date is None:
+            end_date = datetime.now().date()
+        start_date = end_date.replace(day=1)
+
+        count = len(data)
+        days = (end_date - start_date).days
+        observation_date = np.datetime64(start_date, "D") + self._rng.integers(
+            0, days, count, endpoint=True
+        ).astype("timedelta64[D]")
+
+        age = data[DataSet.AGE.name].to_numpy(dtype=np.int64)
+        age_days = self._rng.integers(
+            age * 365 + 30, (age + 1) * 365 - 30, endpoint=True
         )
-        return row
+        birthday = observation_date - age_days.astype("timedelta64[D]")
 
-    def _determine_dates(self, data: pd.DataFrame) -> pd.DataFrame:
-        cur_date = datetime.now()
-        start_date = datetime(cur_date.year, cur_date.month, 1)
-        end_date = cur_date
+        report_days = self._rng.integers(1, 15, count, endpoint=True)
+        report_date = observation_date + report_days.astype("timedelta64[D]")
 
-        data[Observation.OBSERVATION_DATE.name] = [
-            start_date + timedelta(days=random.randint(0, (end_date - start_date).days))
-            for _ in range(len(data))
-        ]
-        data = data.apply(self._calculate_birthday, axis=1)
-        data = data.apply(self._calculate_report_date, axis=1)
+        data[Observation.OBSERVATION_DATE.name] = observation_date.astype(
+            "datetime64[ns]"
+        )
+        data[Patient.BIRTHDAY.name] = birthday.astype("datetime64[ns]")
+        data[FinalReport.REPORT_DATE.name] = report_date.astype("datetime64[ns]")
 
         return data
 
-    def _check_age(self, row: pd.Series) -> pd.Series:
-        spread = relativedelta(
-            row[Observation.OBSERVATION_DATE.name], row[Patient.BIRTHDAY.name]
-        )
-        relative_age = spread.years
-        row["age_spread"] = row[DataSet.AGE.name] - relative_age
-        return row
-
     def check_age(self, data: pd.DataFrame):
-        data = data.apply(self._check_age, axis=1)
-        spread = data["age_spread"].sum()
+        if len(data) > CHECK_AGE_ROWS:
+            data = data.sample(CHECK_AGE_ROWS, random_state=self.seed)
+
+        relative_age = count_years(
+            data[Patient.BIRTHDAY.name],
+            data[Observation.OBSERVATION_DATE.name],
+        )
+        spread = (data[DataSet.AGE.name] - relative_age).sum()
         assert spread == 0
 
-    def get_data(self):
+    def get_data(
+        self,
+        n_rows: int = None,
+        scale_factor: float = None,
+        end_date: date = None,
+    ) -> pd.DataFrame:
+        """
+        n_rows, or scale_factor times the seed rows, resampled
+        with replacement. Without both, every seed row once.
+        """
         data = self._read_data()
         data = self._rename(data)
 
-        data = data.apply(self._get_personal_info, axis=1)
-        data = self._determine_dates(data)
+        if n_rows is None and scale_factor is not None:
+            n_rows = int(len(data) * scale_factor)
+        if n_rows is not None:
+            data = self._resample(data, n_rows)
+
+        data = self._get_personal_info(data)
+        data = self._determine_dates(data, end_date)
         data[Patient.GENDER.name] = "f"
         data[FinalReport.DIAGNOSIS.name] = data[FinalReport.DIAGNOSIS.name].astype(bool)
 
@@ -0,0 +1,76 @@
+import uuid
+from datetime import date
+
+from database import DataBaseInterface
+from notation import Attribute, Notation, Patient, Observation
+from util import PatientObject
+
+
+def make_patients(count: int) -> list[PatientObject]:
+    # Unique names, so reruns against the same database do not collide.
+    run = uuid.uuid4().hex[:8]
+    return [
+        PatientObject(
+            {
+                Patient.FIRST_NAME.name: f"first-{run}-{index}",
+                Patient.LAST_NAME.name: f"last-{run}-{index}",
+                Patient.PATRONYMIC.name: None,
+                Patient.BIRTHDAY.name: date(1990, 1, 1 + index % 28),
+                Patient.PHONE_NUMBER.name: f"8{index:010d}",
+                Patient.GENDER.name: "m" if index % 2 else "f",
+            }
+        )
+        for index in range(count)
+    ]
+
+
+async def fetch_column(
+    db: DataBaseInterface,
+    notation: Notation,
+    id_key: Attribute,
+    value_key: Attribute,
+    ids: list[int],
+) -> dict[int, object]:
+    query = f"""
+            SELECT {id_key.name}, {value_key.name}
+            FROM {notation.TABLE_NAME}
+            WHERE {id_key.name} = ANY($1::INT[]);
+            """
+    async with db._pool.acquire() as connection:
+        rows = await connection.fetch(query, ids)
+    return {row[0]: row[1] for row in rows}
+
+
+def test_insert_patients_data_ids_follow_input_order(database):
+    loop, db = database
+    patients = make_patients(50)
+
+    ids = loop.run_until_complete(db.insert_patients_data(patients))
+    names = loop.run_until_complete(
+        fetch_column(db, Patient, Patient.PATIENT_ID, Patient.FIRST_NAME, ids)
+    )
+
+    assert len(set(ids)) == len(patients)
+    assert [names[patient_id] for patient_id in ids] == [
+        patient[Patient.FIRST_NAME.name] for patient in patients
+    ]
+
+
+def test_schedule_observations_ids_follow_input_order(database):
+    loop, db = database
+    patients = make_patients(50)
+
+    patients_ids = loop.run_until_complete(db.insert_patients_data(patients))
+    for patient, patient_id in zip(patients, patients_ids):
+        patient[Patient.PATIENT_ID.name] = patient_id
+
+    settled_dates = [date(2024, 1, 1 + index % 28) for index in range(len(patients))]
+    ids = loop.run_until_complete(db.schedule_observations(patients, settled_dates))
+    owners = loop.run_until_complete(
+        fetch_column(
+            db, Observation, Observation.OBSERVATION_ID, Observation.PATIENT_ID, ids
+        )
+    )
+
+    assert len(set(ids)) == len(patients)
+    assert [owners[observation_id] for observation_id in ids] == patients_ids
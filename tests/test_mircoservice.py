@@ -0,0 +1,171 @@
+import asyncio
+import asyncpg
+import numpy as np
+from aiohttp import web
+from aiohttp.test_utils import TestClient, TestServer
+
+from database import DataBaseInterface, WriteBehindBuffer, DB_KEY
+from notation import Feature, Patient, Observation, PreliminaryReport
+from pipeline import PipelineSlot
+from serving import (
+    InferenceExecutor,
+    MicroBatcher,
+    ModelReloader,
+    IncrementalLearner,
+    BATCHER_KEY,
+    RELOADER_KEY,
+    LEARNER_KEY,
+)
+from mircoservice import routes, check_patient_id
+
+
+PROBABILITY = 0.25
+
+
+class ConstantPipeline(object):
+    """
+    Scores every observation with PROBABILITY, in place of a trained bundle.
+    """
+
+    version = "constant"
+    generation = 0
+    bundle_path = None
+    bundle = None
+
+    def predict_many(self, observations: list[tuple]) -> np.ndarray:
+        return np.full(len(observations), PROBABILITY)
+
+
+def observation_body() -> dict:
+    body = {
+        column: 1.0 for column in Feature.numeric_columns if column != Feature.AGE.name
+    }
+    body[Patient.BIRTHDAY.name] = "1990-01-01"
+    body[Observation.OBSERVATION_DATE.name] = "2024-01-01"
+    return body
+
+
+async def create_client(db: DataBaseInterface = None) -> TestClient:
+    slot = PipelineSlot(ConstantPipeline())
+    db = db or DataBaseInterface(1)
+
+    app = web.Application(middlewares=[check_patient_id])
+    app[BATCHER_KEY] = MicroBatcher(slot, InferenceExecutor("thread", 1))
+    app[RELOADER_KEY] = ModelReloader(slot)
+    app[LEARNER_KEY] = IncrementalLearner(slot, db)
+    app[DB_KEY] = db
+    app.add_routes(routes)
+
+    app[BATCHER_KEY].start()
+    client = TestClient(TestServer(app))
+    await client.start_server()
+    return client
+
+
+async def close_client(client: TestClient) -> None:
+    await client.app[BATCHER_KEY].stop()
+    await client.app[BATCHER_KEY].executor.shutdown()
+    await client.close()
+
+
+def test_predict_batches_concurrent_requests():
+    async def run() -> tuple[list, dict]:
+        client = await create_client()
+        try:
+            responses = await asyncio.gather(
+                *[client.post("/predict", json=observation_body()) for _ in range(8)]
+            )
+            bodies = [
+                (response.status, await response.json()) for response in responses
+            ]
+
+            metrics = await client.get("/metrics")
+            return bodies, await metrics.json()
+        finally:
+            await close_client(client)
+
+    bodies, metrics = asyncio.run(run())
+
+    diagnosis = PreliminaryReport.PRELIMINARY_DIAGNOSIS.name
+    assert bodies == [(200, {diagnosis: PROBABILITY})] * 8
+    assert metrics["batcher"]["requests"] == 8
+    assert 1 <= metrics["batcher"]["batches"] <= 8
+    assert metrics["model"]["version"] == ConstantPipeline.version
+    assert metrics["reports"] is None
+
+
+def test_predict_rejects_invalid_observation():
+    async def run() -> int:
+        client = await create_client()
+        try:
+            response = await client.post("/predict", json={"glucose": "high"})
+            return response.status
+        finally:
+            await close_client(client)
+
+    assert asyncio.run(run()) == 400
+
+
+def test_pages_still_need_patient_id_cookie():
+    async def run() -> tuple[int, str]:
+        client = await create_client()
+        try:
+            response = await client.get("/menu", allow_redirects=False)
+            return response.status, response.headers["Location"]
+        finally:
+            await close_client(client)
+
+    assert asyncio.run(run()) == (302, "/patient_id")
+
+
+def test_reload_rejects_malformed_body():
+    async def run() -> list[int]:
+        client = await create_client()
+        try:
+            statuses = []
+            for body in ["{", "[]", '{"version": 5}', '{"version": null}']:
+                response = await client.post("/admin/reload", data=body)
+                statuses.append(response.status)
+            return statuses
+        finally:
+            await close_client(client)
+
+    assert asyncio.run(run()) == [400] * 4
+
+
+def test_predict_report_of_unknown_observation_is_dropped_behind():
+    known_ids = {1, 2}
+    written = []
+
+    async def write(rows: list[tuple]) -> None:
+        # Like the observation_id foreign key of preliminary_report.
+        if any(row[0] not in known_ids for row in rows):
+            raise asyncpg.ForeignKeyViolationError("unknown observation_id")
+        written.extend(rows)
+
+    async def run() -> tuple[list[int], dict]:
+        db = DataBaseInterface(1)
+        db.reports_buffer = WriteBehindBuffer(write, flush_interval_ms=1)
+        db.reports_buffer.start()
+
+        client = await create_client(db)
+        try:
+            statuses = []
+            for observation_id in [1, 404, 2]:
+                body = observation_body()
+                body[Observation.OBSERVATION_ID.name] = observation_id
+                response = await client.post("/predict", json=body)
+                statuses.append(response.status)
+
+            # Flushes the acknowledged reports.
+            await db.reports_buffer.stop()
+            return statuses, db.reports_buffer.metrics()
+        finally:
+            await close_client(client)
+
+    statuses, metrics = asyncio.run(run())
+
+    assert statuses == [200] * 3
+    assert sorted(row[0] for row in written) == [1, 2]
+    assert metrics["written_rows"] == 2
+    assert metrics["failed_rows"] == 1